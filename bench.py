@@ -0,0 +1,256 @@
+"""
+Benchmarks of the stages of the render pipeline on synthetic workbooks.
+
+    python bench.py                          # small scales, a few minutes
+    python bench.py --full                   # up to 1M rows and 10k slides
+    python bench.py --out bench.jsonl        # results are appended as JSON lines, one per stage and scale
+    python bench.py --compare old.jsonl      # compare with the results of an earlier commit
+    python bench.py --header-row 12 --null-density 0.5 --cardinality 1000    # shape of the generated workbooks
+
+Every stage is timed on its own: the load path of the UI(read_grid parsing the whole sheet, slice_region cutting out the
+region), the bounded reader of the CLI(read_region), extract_rows, convert_to_categories, copying the cached template
+(load_template) against parsing it again(parse_template), create_a_slide_with_data, create_a_chart(with and without
+embedded workbooks) and prs.save. Generated workbooks are kept in bench_dir and reused.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+from io import BytesIO
+
+# for excel
+import openpyxl
+
+from src import pipeline, cache
+from src.util import *
+from src.ingest import *
+from src.render import *
+
+bench_dir = '.pystar_bench'    # Directory in which generated workbooks are kept
+default_template = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'template.pptx')
+
+row_scales = [1000, 10000, 100000]    # Rows of the generated workbooks
+slide_scales = [10, 100, 1000]    # Table slides per deck
+full_row_scales = row_scales + [1000000]
+full_slide_scales = slide_scales + [10000]
+charts_per_slides = 10    # One chart is rendered per this many table slides, charts are a lot slower than tables
+template_loads = 20    # Presentations made from the template per template stage, a single one takes a few milliseconds
+min_cols = 3    # Columns the stages read: ID, Status and at least one category column
+shape_options = ['cols', 'header_row', 'header_col', 'null_density', 'cardinality']    # Options of generate_workbook that can be set from the command line
+
+
+def generate_workbook(path, rows, cols=6, header_row=3, header_col=2, null_density=0.1, cardinality=20, seed=0):
+    """
+    Write a synthetic workbook shaped like the reports fed to the UI: some empty rows and columns before the start cell,
+    the column titles at the start cell and @param rows rows below it.
+    The first column is a unique ID, the second column "Status" is empty for about half the rows(closed cases),
+    the other columns hold categories.
+
+    @param path: Path of the xlsx file to be written.
+    @param rows: Number of data rows.
+    @param cols: Number of columns, at least min_cols.
+    @param header_row: Row number(1-based) of the column titles.
+    @param header_col: Column number(1-based) of the first column.
+    @param null_density: Share of the category cells left empty.
+    @param cardinality: Number of distinct values per category column.
+    @param seed: Seed of the random values, the same arguments always give the same workbook.
+    """
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    pad = [None]*(header_col-1)
+    for i in range(header_row-1):
+        ws.append([])
+
+    ws.append(pad + column_titles(cols))
+    categories = ['Value %d' % i for i in range(cardinality)]
+    for i in range(rows):
+        row = pad + [i+1, 'Open' if rnd.random() < 0.5 else None]
+        for j in range(cols-2):
+            row.append(None if rnd.random() < null_density else rnd.choice(categories))
+        ws.append(row)
+    wb.save(path)
+
+def column_titles(cols=6):
+    """
+    Column titles of a generated workbook: ID, Status and the category columns Col 3, Col 4, ...
+
+    @param cols: Number of columns.
+    @return: @Array of column titles
+    """
+    return ['ID', 'Status'] + ['Col %d' % i for i in range(3, cols+1)]
+
+def workbook(rows, **kwargs):
+    """
+    Path of a generated workbook, it is generated on first use only.
+
+    @param rows: Number of data rows, see generate_workbook for the other arguments.
+    @return: Path of the xlsx file.
+    """
+    os.makedirs(bench_dir, exist_ok=True)
+    name = '_'.join(['%s%s' % (k, v) for k, v in sorted(kwargs.items())])
+    path = os.path.join(bench_dir, 'rows%d%s.xlsx' % (rows, '_' + name if name else ''))
+    if not os.path.exists(path):
+        print('generating %s ...' % path, flush=True)
+        generate_workbook(path, rows, **kwargs)
+    return path
+
+def _commit():
+    # commit the results belong to, None outside of a git checkout
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+class Recorder:
+    """
+    Times stages and collects the results as dicts.
+    """
+
+    def __init__(self, out=None):
+        """
+        @param out: [Optional] Path of a JSON lines file the results are appended to.
+        """
+        self.out = out
+        self.results = []
+        self.meta = {'commit': _commit(), 'python': platform.python_version(), 'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    def time(self, stage, fn, **scale):
+        """
+        Run @param fn once and record its wall time.
+
+        @param stage: Name of the stage, e.g. get_data.
+        @param fn: Function without arguments.
+        @param scale: Size of the input, e.g. rows=1000.
+        @return: Return value of @param fn
+        """
+        start = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - start
+        result = dict(self.meta, stage=stage, seconds=round(seconds, 4), **scale)
+        self.results.append(result)
+        print('%-26s %-28s %9.3fs' % (stage, ' '.join('%s=%s' % ele for ele in scale.items()), seconds), flush=True)
+        if self.out:
+            with open(self.out, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result) + '\n')
+        return value
+
+def load(path, header_row=3, header_col=2):
+    """
+    Load a generated workbook the way the UI does: the whole sheet is parsed into a raw grid and the region is cut out of it.
+    """
+    return slice_region(read_grid(path), header_row, header_col, '-')
+
+def bench_rows(rec, rows, **shape):
+    """
+    Time the data stages on a workbook of @param rows rows.
+
+    @param shape: Options of generate_workbook, e.g. null_density=0.5.
+    """
+    path = workbook(rows, **shape)
+    header_row, header_col = shape.get('header_row', 3), shape.get('header_col', 2)
+    grid = rec.time('read_grid', lambda: read_grid(path), rows=rows, **shape)
+    df = rec.time('slice_region', lambda: slice_region(grid, header_row, header_col, '-'), rows=rows, **shape)
+    rec.time('read_region', lambda: read_region(path, header_row, header_col, '-'), rows=rows, **shape)
+
+    categories = column_titles(shape.get('cols', 6))[2:]
+    config = pipeline.default_config()
+    config.update(openCaseCol='Status', opcsheads=['ID', 'Status', categories[0]], cscsheads=['ID'] + categories[1:3])
+    rec.time('extract_rows', lambda: pipeline.extract_case_rows(df, config), rows=rows, **shape)
+    rec.time('convert_to_categories', lambda: convert_to_categories(df[categories[0]], '-', True), rows=rows, **shape)
+
+def bench_template(rec, template):
+    """
+    Time getting template_loads presentations from the template: copies of the template cached by cache.load_template
+    and presentations parsed from the bytes every time.
+    """
+    # the first call parses and caches the template
+    cache.load_template(template)
+    rec.time('load_template', lambda: [cache.load_template(template) for i in range(template_loads)], templates=template_loads)
+    rec.time('parse_template', lambda: [Presentation(BytesIO(template)) for i in range(template_loads)], templates=template_loads)
+
+def bench_slides(rec, slides, template, **shape):
+    """
+    Time rendering and saving a deck of @param slides table slides, plus one chart per charts_per_slides slides.
+
+    @param shape: Options of generate_workbook, e.g. null_density=0.5.
+    """
+    rows_per_slide = 6
+    path = workbook(max(1000, slides*rows_per_slide), **shape)
+    df = load(path, shape.get('header_row', 3), shape.get('header_col', 2))
+    # tables show up to 6 columns
+    headers = column_titles(shape.get('cols', 6))[:6]
+    data = pipeline.extract_table_rows(df, headers, '-')
+    tasks = table_tasks(data, rows_per_slide, 'Table', '-')[:slides]
+
+    prs = cache.load_template(template)
+    rec.time('create_a_slide_with_data', lambda: render_tasks(prs, tasks), slides=len(tasks), **shape)
+
+    charts = max(1, slides//charts_per_slides)
+    chart_data = convert_to_categories(df[headers[2]], '-', True)
+    rec.time('create_a_chart', lambda: render_tasks(prs, [chart_task(chart_data, [0.5,0.6,12,6.5], 'bar', 'Chart')]*charts), charts=charts, **shape)
+    rec.time('create_a_chart_light', lambda: render_tasks(prs, [chart_task(chart_data, [0.5,0.6,12,6.5], 'bar', 'Chart', False)]*charts), charts=charts, **shape)
+
+    rec.time('prs.save', lambda: prs.save(BytesIO()), slides=len(prs.slides), **shape)
+
+def compare(old, new):
+    """
+    Print the ratio of the timings of two runs, matched by stage and scale. Ratios above 1 are slowdowns.
+
+    @param old: Path of a JSON lines file with earlier results, the latest entry of every stage and scale is used.
+    @param new: @Array of results of this run.
+    """
+    def key(result):
+        return (result['stage'], result.get('rows'), result.get('slides'), result.get('charts'), result.get('templates')) + tuple(result.get(ele) for ele in shape_options)
+    before = {}
+    with open(old, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                before[key(result)] = result
+    for result in new:
+        if key(result) in before and before[key(result)]['seconds'] > 0:
+            ratio = result['seconds']/before[key(result)]['seconds']
+            print('%-26s %-28s %6.2fx' % (result['stage'], ' '.join('%s=%s' % ele for ele in zip(['rows', 'slides', 'charts', 'templates'] + shape_options, key(result)[1:]) if ele[1] is not None), ratio))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench', description='Time the stages of the render pipeline on synthetic workbooks.')
+    parser.add_argument('--full', action='store_true', help='Run the big scales as well(1M rows, 10k slides).')
+    parser.add_argument('--rows', type=int, nargs='*', default=None, help='Row scales to run, overrides the defaults.')
+    parser.add_argument('--slides', type=int, nargs='*', default=None, help='Slide scales to run, overrides the defaults.')
+    parser.add_argument('--template', default=default_template, help='Template pptx file.')
+    parser.add_argument('--cols', type=int, default=None, help='Columns of the generated workbooks, at least %d.' % min_cols)
+    parser.add_argument('--header-row', type=int, default=None, help='Row number(1-based) of the column titles of the generated workbooks.')
+    parser.add_argument('--header-col', type=int, default=None, help='Column number(1-based) of the first column of the generated workbooks.')
+    parser.add_argument('--null-density', type=float, default=None, help='Share of the category cells left empty, between 0 and 1.')
+    parser.add_argument('--cardinality', type=int, default=None, help='Number of distinct values per category column.')
+    parser.add_argument('--out', default=None, help='Append the results to this JSON lines file.')
+    parser.add_argument('--compare', default=None, help='JSON lines file of an earlier run to compare with.')
+    args = parser.parse_args(argv)
+    if args.cols is not None and args.cols < min_cols:
+        parser.error('--cols must be at least %d, the stages read ID, Status and a category column' % min_cols)
+
+    rows = args.rows if args.rows is not None else (full_row_scales if args.full else row_scales)
+    slides = args.slides if args.slides is not None else (full_slide_scales if args.full else slide_scales)
+    template = template_bytes(args.template)
+
+    # only the options that are set are passed, so the default workbooks keep their names
+    shape = {key: getattr(args, key) for key in shape_options if getattr(args, key) is not None}
+
+    rec = Recorder(args.out)
+    for n in rows:
+        bench_rows(rec, n, **shape)
+    bench_template(rec, template)
+    for n in slides:
+        bench_slides(rec, n, template, **shape)
+
+    if args.compare:
+        compare(args.compare, rec.results)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
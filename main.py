@@ -6,6 +6,10 @@ import collections.abc
 
 # Pandas for dataframes
 import os
+import time
+import uuid
+import tempfile
+from concurrent.futures import CancelledError
 import pandas as pd
 import numpy as np
 from math import isnan
@@ -16,7 +20,16 @@ from pptx.util import Inches, Cm, Pt
 
 # importing all utility functions
 from src.util import *
-import streamlit.components.v1 as components  # Import Streamlit
+from src.ingest import *
+from src.render import *
+from src import cache, pipeline, jobs, perf, sessions, predicates
+
+# newer Streamlit versions take a function as the data of a download button and only call it when the button is clicked
+try:
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    deferred_download = hasattr(MediaFileManager, 'add_deferred')
+except ImportError:
+    deferred_download = False
 
 
 
@@ -36,18 +49,15 @@ st.set_page_config(
 
 # logo and header
 # <h1 style="font-size: 25px"> Excel to PPT Automation </h1>
-components.html(f"""
-    <div style="text-align: right;height: 100%;width:100%;font-family: Helvetica;
-    margin-top: -20px;
-    background-repeat: no-repeat;
-    "> 
-        <h1 style="font-size: 50px"> pyStAR 🌠 </h1>
-        
-    </div>
-    <div>
-        <hr style="width:100%;text-align:left;margin-left:0;color:black;background-color:black;height: 2px;border-radius: 25px;">
-    </div>
-""", height=170)
+# plain markdown instead of an iframe, so that reruns do not rebuild a component
+st.markdown("""
+<div style="text-align: right;height: 100%;width:100%;font-family: Helvetica;margin-top: -20px;background-repeat: no-repeat;">
+    <h1 style="font-size: 50px"> pyStAR 🌠 </h1>
+</div>
+<div>
+    <hr style="width:100%;text-align:left;margin-left:0;color:black;background-color:black;height: 2px;border-radius: 25px;">
+</div>
+""", unsafe_allow_html=True)
 
 # st.markdown("# pyStAR ⭐")
 # st.markdown("# Excel to PPT Automation")
@@ -55,189 +65,167 @@ components.html(f"""
 #globals
 default_template = 'data/template.pptx'
 template_file = default_template
-prs = Presentation(template_file)    # PPT Presentation object
-prs.slide_width = Cm(33.858)    # Width of the slide
-prs.slide_height = Cm(19.05)    # Height of the slide
 sz = 6    # Global parameter(later overwritten) for setting rows per slide
 limit = -1    # Dev mode only feature
+workbook_cache = True    # Keep parsed sheets in an on disk cache keyed by the contents of the upload
+ingest_workers = None    # Number of processes parsing the sheets of a multi file or multi sheet upload at once, None for one per core
+parallel_render = False    # Render the slides on a process pool instead of one after another
+render_workers = None    # Number of processes used by parallel_render, None for every core no other render uses when it starts
+chart_workbooks = True    # Embed a workbook with the data of every chart, without it charts are faster and smaller but their data can not be edited in PowerPoint
+streaming_output = False    # Write slides to the output file as they are rendered instead of keeping the whole deck in memory
+output_spill_bytes = 64*1024**2    # Finished decks bigger than this are moved from memory to a temp file of the session
+incremental_render = True    # Reuse the slides of the deck sections that did not change since an earlier submit
+deck_cache = True    # Serve a deck rendered before from the same data, template and settings from the on disk cache
+render_queue_timeout = 60    # Seconds a submission waits for a place in the render queue of the server
+render_poll_interval = 0.5    # Seconds between two refreshes of the progress bar of a running render
+render_abandon_after = 30    # Seconds without a refresh after which a render of a closed session stops by itself
+compact_session_data = True    # Keep the sheet and the data of a session as categoricals and Arrow strings, see compact_frame
+perf_log = 'pystar_perf.jsonl'    # Stage timings of every load and render are appended to this file, None to switch it off
+load_timer = perf.Timer()    # Stages of the loads done by this run of the script
+profile_render = False    # Run the next render under cProfile and show the report in the Performance expander
 
 # user input
 user_start_location = None    # Starting cell address, e.g: A13
 break_into_slides = "no"    # If we want to break data into opencases and closed cases
-global_compare_false_val = '-'    # This value is considered as False value and rows corresponding to this value are put in closed case slide.
+global_compare_false_val = '-'    # Rows passing this rule(e.g. a value like -, a list like -,NO or a threshold like <= 0, see src/predicates.py) are put in closed case slide.
 global_null_value = '-'    # This value acts as empty value in the dataframe as well as on the PPT slides
 openCaseCol = None    # This column is used to segreagate opencases and closedcases
 opcsheads = []    # Headers/Column names for opencases
 cscsheads = []    # Headers/Column names for closedcases
 opencases = []    # Rows to be displayed on open case slide
 closedcases = []    # Rows to be displayed on close case slide
-ext_tab_arr = []    # Array containing data to be displayed on extra slides
+ext_tab_arr = []    # Array containing data to be displayed on extra slides, optionally with a row filter, a sort and a row limit each(see pipeline.select_rows)
 ext_cha_arr = []    # Array containing data from which charts are to be created
+section_by = None    # Column the deck is split by(the source column of a multi file upload), every section is rendered once per source
 openCase_rows_per_slide = sz    # Number of rows to be displayed per slide in opencases
 closeCase_rows_per_slide = sz    # Number of rows to be displayed per slide in closedcases
+case_groups = []    # [[title, rule, column titles, rows per slide], ...], splits the cases into more than two groups instead of open and closed cases
 
-beginx = None    # Utility variable that stores staring row address of the data
-beginy = None    # Utility variable that stores staring column address of the data
 dataframe = None    # Will be updated with the Final Data after it is extracted from excel file
+session_key = None    # Key of the data of this session in the server wide session store, see src/sessions.py
 
-def get_data(file):
+def get_grids(items):
     """
-    Extracts data from an Excel file into a dataframe.
+    Parses whole sheets of Excel files(or CSV, Parquet and Feather files, see read_grid) into raw grids(no header or offsets applied),
+    several sheets are parsed at once.
+    When workbook_cache is on, the grids are kept on disk and re-uploads of the same workbooks are served from the cache.
 
-    @param file: Path to the excel file
-    @return: Pandas dataframe
+    @param items: @Array of (file, sheet), file is a path or an uploaded file and sheet the index or name of the sheet to be read.
+    @return: @Array of Pandas dataframes holding the raw grids, in the order of @param items.
     """
-    # global references
-    global beginx, beginy
-
-    # reading excel file, extracting all data
-    df = pd.read_excel(file, dtype=str)
-
-    # handling cases where first row of the excel file may be empty, or the data is offset by some rows.
-    beginy = max(0, beginy-1)
-    if beginx > 2:
-        beginx -= 2
-    else:
-        beginx -= 1
-
-    # truncating dataframe according to the offsets: beginx, beginy
-    df = df.iloc[beginx:,beginy:]
-
-    # Evaluating headers(column titles)
-    new_header = df.columns
-    if beginx != 0:
-        new_header = df.iloc[0] 
-        df = df[1:] 
-    df.columns = new_header
-
-    # replace null values in the dataframe with global_null_value
-    df = df.replace(np.nan, global_null_value)
-    return df
-
-def extract_rows(df, break_slides=True, headers=[]):
-    """
-    Extracts rows from the excel file. 
-    The parameter break_slides determines whether opencase and closed case segregation is required.
-    If break_slides is True, data extracted from @Dataframe df is divided into 2 @Array opencases and @Array closedcases.
-    If break_sldies is False, data extracted from @Dataframe df is simply put into @Array entries.
-
-    @param df: dataframe
-    @param break_slides: boolean value to check if segregation of open cases and closed cases is required.
-    @param headers: ONLY REQUIRED when break_slides is false, contains column titles for each slide
-    @return: @Array Opencases and @Array Closedcases when break_slides is True, else returns @Array entries.
-    """
-    
-    # check for the break_slides condition
-    if break_slides == True:
-        # initialize opencases and closed cases arrays
-        opencases = []
-        closedcases = []
-
-        # IMPORTANT : if some column does not exist in the dataframe, 
-        # it is created and filled with null values
-        # checking for both headers
-        for ele in opcsheads:
-            if ele not in dataframe.columns:
-                dataframe[ele] = global_null_value
-        for ele in cscsheads:
-            if ele not in dataframe.columns:
-                dataframe[ele] = global_null_value
-        
-        # get the column on the basis of which data is segregated into open and closed cases
-        open_cases_bool = dataframe[openCaseCol]
+    cached = workbook_cache and cache.feather is not None
+    grids = [None]*len(items)
+    keys = [None]*len(items)
+    if cached:
+        # the raw sheets are looked up by the hash of the upload and the sheet
+        with perf.stage(load_timer, 'load_cache') as counts:
+            for i, (file, sheet) in enumerate(items):
+                keys[i] = cache.make_key(cache.file_digest(file), sheet)
+                grids[i] = cache.load_frame(keys[i])
+            counts['hits'] = sum(ele is not None for ele in grids)
+
+    # the sheets that are not cached are parsed on a process pool, the wall time is about the one of the slowest sheet
+    missing = [i for i in range(len(items)) if grids[i] is None]
+    if missing:
+        with perf.stage(load_timer, 'read_excel', files=len(missing)) as counts:
+            for i, grid in zip(missing, read_concurrently([items[i] for i in missing], workers=ingest_workers)):
+                grids[i] = grid
+            counts.update(rows=sum(len(grids[i]) for i in missing), cells=sum(grids[i].size for i in missing))
+        if cached:
+            with perf.stage(load_timer, 'store_cache'):
+                for i in missing:
+                    cache.store_frame(keys[i], grids[i])
+    return grids
+
+def source_grids(items, keys):
+    """
+    Raw sheets of the chosen sources. They are taken from the session store when this session or another one holds them,
+    the others are parsed(see get_grids) and kept there. Files that can not be read stop the script with an error.
 
-        opencaseheaders = opcsheads
-        closedcaseheaders = cscsheads
-        
-        # extracting data according to the specified column header for opencases
-        opendf = df[opencaseheaders]
+    @param items: @Array of (position of the uploaded file, sheet).
+    @param keys: @Array of content keys of the sheets, one per item.
+    @return: @Array of raw grids, in the order of @param items.
+    """
+    names = ['grid/' + key for key in keys]
+    grids = [sessions.get(session_key, name) for name in names]
+    for j in range(len(grids)):
+        if grids[j] is None:
+            grids[j] = sessions.attach(session_key, names[j], keys[j])
+    # the sheets nobody parsed yet are parsed at once
+    missing = [j for j in range(len(grids)) if grids[j] is None]
+    if missing:
+        # broken or unsupported files are reported instead of failing the whole page
+        try:
+            parsed = get_grids([(uploaded_files[items[j][0]], items[j][1]) for j in missing])
+        except Exception as e:
+            st.error(f"ERROR: The uploaded files could not be read: {e}")
+            st.stop()
+        for j, grid in zip(missing, parsed):
+            grids[j] = keep(names[j], grid, keys[j])
+    return grids
+
+def get_grid(file, sheet=0):
+    """
+    Parses a whole sheet of an Excel file into a raw grid, see get_grids.
 
-        # first entry in opencases are the column titles, these titles make up the topmost row displayed in every slide.
-        opencases.append(opendf.columns.tolist())
-        
-        # extract data for opencases
-        for index, row in opendf.iterrows():
-            temp = []
-            # comparator_break is used to segregate the data
-            if comparator_break(open_cases_bool[index], global_compare_false_val):
-                continue
-            # if the row is valid, this goes in @Array opencases 
-            for ele in row:
-                temp.append(str(ele))
-            opencases.append(temp)
-        
-        # extracting data according to the specified column header for closedcases
-        closedf = df[closedcaseheaders]
-
-        # first entry in closedcases are the column titles, these titles make up the topmost row displayed in every slide.
-        closedcases.append(closedf.columns.tolist())
-        # extract data for closedcases
-        for index, row in closedf.iterrows():
-            temp = []
-            # comparator_break is used to segregate the data
-            if not comparator_break(open_cases_bool[index], global_compare_false_val):
-                continue
-
-            # if the row is valid, this goes in @Array closedcases
-            for ele in row:
-                temp.append(str(ele))
-            closedcases.append(temp)
-        
-        # return the @Array opencases and @Array closedcases
-        return opencases, closedcases
-        
-    else:
-        # if break_sides is False
-        # initialise @Array entries
-        entries = []
+    @param file: Path to the excel file
+    @param sheet: Index or name of the sheet to be read.
+    @return: Pandas dataframe holding the raw grid.
+    """
+    return get_grids([(file, sheet)])[0]
 
-        # if invalid headers were passed return empty entries
-        if len(headers) == 0:
-            return [[]]
-        else:
-            # IMPORTANT : if some column does not exist in the dataframe, 
-            # it is created and filled with null values
-            # checking for both headers
-            for ele in headers:
-                if ele not in dataframe.columns:
-                    dataframe[ele] = global_null_value
-
-        # extracting data according to the specified column headers
-        opendf = df[headers]
-        # first entry in entries are the column titles, these titles make up the topmost row displayed in every slide.
-        entries.append(opendf.columns.tolist())
-        for index, row in opendf.iterrows():
-            temp = []
-            for ele in row:
-                temp.append(str(ele))
-            entries.append(temp)
-        
-        return entries
+def slice_sources(grids, names, start, usecols=None):
+    """
+    Cuts the data region starting at the start cell out of the raw sheet of every source.
+    The regions of several sources are put below each other, with a column naming the source of every row(see concat_sources).
 
-def present_on_slide(data,sz=6, title=''):
+    @param grids: @Array of raw grids, see get_grids.
+    @param names: @Array of names of the sources.
+    @param start: Starting cell address, e.g: A13
+    @param usecols: [Optional] Column titles to be kept.
+    @return: Pandas dataframe
+    """
+    cols, rows = split_start_address(start)
+    with perf.stage(load_timer, 'slice_region') as counts:
+        frames = []
+        for grid in grids:
+            df = slice_region(grid, int(rows), convert_excel_col_number(cols), global_null_value, usecols)
+            frames.append(df.loc[:, df.columns.notna()])
+        df = frames[0] if len(frames) == 1 else concat_sources(frames, names, global_null_value)
+        counts.update(rows=len(df), cells=df.size)
+    return df.reset_index(drop=True)
+
+def deck_config():
     """
-    Present final extracted data on a slide
+    Deck configuration made from the current UI settings, see pipeline.default_config.
 
-    @param data: @2DArray with first entry as the column titles and rest of the entries as the subsequent rows.
-    @param sz: number of rows to be displayed per slide.
+    @return: dict
     """
-    n = len(data)
+    config = pipeline.default_config()
+    config.update({
+        'user_start_location': user_start_location,
+        'global_null_value': global_null_value,
+        'openCaseCol': openCaseCol,
+        'global_compare_false_val': global_compare_false_val,
+        'opcsheads': opcsheads,
+        'cscsheads': cscsheads,
+        'openCase_rows_per_slide': openCase_rows_per_slide,
+        'closeCase_rows_per_slide': closeCase_rows_per_slide,
+        'case_groups': case_groups,
+        'ext_tab_arr': ext_tab_arr,
+        'ext_cha_arr': ext_cha_arr,
+        'chart_workbooks': chart_workbooks,
+        'section_by': section_by,
+    })
+    return config
+
+def deck_columns():
+    """
+    Column titles referenced by the current deck configuration.
 
-    # dev mode only
-    if limit != -1:
-        n = min(limit, n)
-    
-    # break data into chunks of size @param sz per slide
-    for i in range(1, n, sz):
-        # data[0] are the column titles
-        entries = [data[0]]
-        # break the chunk
-        entries += data[i:i+sz]
-        naming = title
-        if i > 1: 
-            naming += ' Continued...'
-        # create the PPT slide
-        create_a_slide_with_data(prs, entries, titleofslide=naming, global_null_value=global_null_value)
+    @return: @Array of column titles used by the case split, the open/closed case tables, the extra tables and the charts.
+    """
+    return pipeline.deck_columns(deck_config())
 
 def create_a_multiselect(headers, key, title=''):
     """
@@ -265,134 +253,278 @@ def create_a_multiselect(headers, key, title=''):
     # return selected columns and the trigger associated with the checkbox
     return opcsheads, want_all_open
 
-def end_slide():
-    """
-    Append the end slide to the PPT
-
-    """
-    layout = prs.slide_layouts[5]
-    slide=prs.slides.add_slide(layout)
-    # slide.shapes.add_picture('data/end.png', 0, 0, prs.slide_width, prs.slide_height)
-
-
-def commence_ppt_creation():
-    """
-    Generates PPT slides for Charts, Closed cases, Open cases and Extra slides as per the requirement.
-
-    """
-    # extract data if the column headers are valid
-    if len(opcsheads) > 0 or len(cscsheads) > 0:
-        opencases, closedcases = extract_rows(dataframe, True)
-    if len(opcsheads) == 0:
-        opencases = []
-    if len(cscsheads) == 0:
-        closedcases = []
-    
-    # display charts onto the slides
-    for ele in ext_cha_arr:
-        data_col = ele[0]
-        chart_type = ele[1].lower()
-        title = ele[2]
-        # get the data to be displayed onto the chart
-        data = convert_to_categories(dataframe[data_col], global_null_value,True)
-        if chart_type == 'pie':
-            create_a_chart(prs, data, [2.5,1,8,6], None, typeOfChart=chart_type, nameofchart=title)
-        elif chart_type == 'bar':
-            create_a_chart(prs, data, [0.5,0.6,12,6.5], None, typeOfChart=chart_type, nameofchart=title)
-        elif chart_type == 'donut':
-            create_a_chart(prs, data, [0.5,0.6,12,6.5], None, typeOfChart=chart_type, nameofchart=title)
-
-    # create open cases and closed cases slide if valid    
-    if not (openCaseCol is None or openCaseCol == '<select>'):
-        present_on_slide(opencases, openCase_rows_per_slide, 'Open Cases')
-        present_on_slide(closedcases, closeCase_rows_per_slide, 'Closed Cases')
-    
-    # Create extra tables that were selected in the UI
-    for ele in ext_tab_arr:
-        data = ele[0]
-        data = extract_rows(dataframe, False, data)
-        title = ele[1]
-        rows_per_slide = ele[2]
-        present_on_slide(data, rows_per_slide, title)
-    
-    end_slide()
-
-    # Save the PPT 
-    prs.save("x_final_ppt.pptx")
-    
-    # download the PPT
-    with open("x_final_ppt.pptx", "rb") as file:
-        btn = st.download_button(
-            label="Download PPT",
-            data=file,
-            file_name="pyStAR_final.pptx",
-            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-        )
+def check_rule(rule):
+    """
+    Shows an error for a rule that can not be compiled, see src/predicates.py.
+
+    @param rule: Rule typed by the user.
+    @return: True if the rule is valid.
+    """
+    try:
+        predicates.compile_rule(rule, global_null_value)
+    except ValueError as e:
+        st.error(f"Invalid rule: {e}")
+        return False
+    return True
+
+def commence_ppt_creation(df):
+    """
+    Starts rendering PPT slides for Charts, Closed cases, Open cases and Extra slides as per the requirement.
+    The render runs in the background, its job is kept in the session_state and followed by show_render_job.
+
+    @param df: Data of the deck, e.g. the dataframe cut down to the columns used by the deck.
+    @return: RenderJob, None if the render queue was full.
+    """
+    template = template_bytes(template_file if template_file else default_template)
+
+    # the job gets its own copy of the data and settings and waits for a free worker of the server
+    job = jobs.RenderJob(df, deck_config(), template, parallel_render, render_workers, streaming_output, limit, render_abandon_after, profile_render, incremental_render, deck_cache)
+    try:
+        jobs.submit(job, timeout=render_queue_timeout)
+    except jobs.QueueFull as e:
+        st.error(str(e))
+        return None
+    st.session_state['render_job'] = job
+    remove_keys(['render_output', 'render_summary', 'perf_render', 'perf_profile'])
+    return job
+
+def show_render_job(job):
+    """
+    Shows the progress of a background render, with a button to cancel it.
+    While the job runs the UI refreshes itself every render_poll_interval seconds, once it is done
+    the deck is moved into the output buffer of the session, see show_render_output.
+
+    @param job: RenderJob started by commence_ppt_creation
+    """
+    if not job.future.done():
+        done, total = job.progress()
+        st.progress(done/total if total else 0.0)
+        st.caption(f"Rendering slides... {done} / {total}" if total else "Waiting for a free worker...")
+        if st.button('Cancel', key='cancel_render'):
+            job.cancel()
+        else:
+            # tells the job that this session is still waiting for it
+            job.heartbeat()
+            time.sleep(render_poll_interval)
+        (st.rerun if hasattr(st, 'rerun') else st.experimental_rerun)()
+        return
+
+    try:
+        data, slides, seconds, stages, report = job.future.result()
+    except (jobs.JobCancelled, CancelledError):
+        st.warning("The render was cancelled.")
+        return
+    except Exception as e:
+        st.error(f"The render failed: {e}")
+        return
+
+    # every submission gets its own output buffer, kept in memory and spilled to a private temp file when it gets big.
+    # The deck is written to it once, the job is dropped so that its copy of the bytes is freed.
+    output = tempfile.SpooledTemporaryFile(max_size=output_spill_bytes)
+    output.write(data)
+    del data
+    st.session_state['render_output'] = output
+    st.session_state['render_summary'] = (slides, seconds)
+    del st.session_state['render_job']
+    # stage timings of the render, logged once per render
+    st.session_state['perf_render'] = stages
+    st.session_state['perf_profile'] = report
+    if perf_log:
+        perf.append_log(perf_log, stages, run='render', slides=slides, total_seconds=round(seconds, 3))
+
+def output_reader(output):
+    """
+    @param output: File object, e.g. the output buffer of a render.
+    @return: function returning the whole content of @param output.
+    """
+    def read():
+        output.seek(0)
+        return output.read()
+    return read
+
+def show_render_output():
+    """
+    Shows the download button of the deck of the last finished render of the session.
+    """
+    slides, seconds = st.session_state['render_summary']
+    st.success(f"{slides} slides rendered in {seconds:.1f}s")
+
+    # download the PPT, the bytes come from the buffer of this submission, no file is shared between users.
+    # Where it is supported the buffer is only read when the button is clicked, not on every rerun
+    read = output_reader(st.session_state['render_output'])
+    btn = st.download_button(
+        label="Download PPT",
+        data=read if deferred_download else read(),
+        file_name="pyStAR_final.pptx",
+        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+    )
+
+def show_performance():
+    """
+    Shows the stage timings of the last load and the last render of the session, and the profile of the render if one was taken.
+    """
+    with st.expander("Performance"):
+        for title, key in (('Loading', 'perf_load'), ('Rendering', 'perf_render')):
+            if st.session_state.get(key):
+                st.markdown(f"#### {title}")
+                st.dataframe(pd.DataFrame(st.session_state[key]))
+        if st.session_state.get('perf_profile'):
+            st.markdown("#### Profile")
+            st.text(st.session_state['perf_profile'])
+            st.download_button("Download profile", st.session_state['perf_profile'], file_name="pyStAR_profile.txt", mime="text/plain")
+
+def upload_digests():
+    """
+    @return: @Array of the content hashes of the uploaded files, computed once per upload.
+    """
+    if 'upload_digest' not in st.session_state:
+        st.session_state['upload_digest'] = [cache.file_digest(ele) for ele in uploaded_files]
+    return st.session_state['upload_digest']
+
+def data_key(*parts):
+    """
+    Content key of a value made out of the upload of this session, sessions uploading the same files share the value.
+
+    @param parts: Settings the value depends on, e.g. the start cell.
+    @return: Key for the server wide session store.
+    """
+    return cache.make_key(*upload_digests(), *parts)
+
+def keep(name, value, key=None):
+    """
+    Keeps a big value of this session(e.g. the dataframe) in the server wide session store, compacted when compact_session_data is on.
+    The store evicts the data of idle sessions, the value has to be computed again when it is gone.
+
+    @param name: Name of the value.
+    @param value: Pandas dataframe
+    @param key: [Optional] Content key(see data_key), the value is shared with the other sessions using the same key.
+    @return: The value as it is kept(a shallow copy of it).
+    """
+    if compact_session_data:
+        value = compact_frame(value)
+    sessions.put(session_key, name, value, key)
+    return value.copy(deep=False)
 
 def remove_keys(keys):
     """
-    Removes keys from the session_state.
+    Removes keys from the session_state and from the server wide session store.
 
     @param keys: @Array containing keys that needs to be deleted from st.session_state
     """
+    if 'session_key' in st.session_state:
+        sessions.drop(st.session_state['session_key'], keys)
     for key in keys:
         if key in st.session_state:
             del st.session_state[key]
 
+def reset_sources(upload=True):
+    """
+    Forgets the raw sheets and the data of this session when other files or sheets are chosen.
+
+    @param upload: Other files were uploaded, not only other sheets chosen.
+    """
+    keys = ['grid_names', 'dataframe', 'headers', 'preview'] + st.session_state.get('grid_names', [])
+    if upload:
+        keys += ['detected_start', 'user_start_loc', 'upload_digest', 'sheet_names'] + [key for key in st.session_state if str(key).startswith('sheets_')]
+    remove_keys(keys)
+
 if __name__ == "__main__":
     # get the uploaded file
     st.markdown("## Excel File")
-    uploaded_file = st.file_uploader("Upload your file", type=['xlsx','xlsm'], accept_multiple_files=False, key='upl', on_change=lambda:remove_keys(['dataframe','headers']))
+    # CSV is read without pyarrow as well, Parquet and Feather files need it
+    input_types = ['xlsx','xlsm','csv'] + (['parquet','feather','arrow'] if pyarrow is not None else [])
+    uploaded_files = st.file_uploader("Upload your files", type=input_types, accept_multiple_files=True, key='upl', on_change=reset_sources, help="Excel workbooks, or CSV, Parquet and Feather exports, which load a lot faster. Several files(e.g. one per region) can be uploaded at once, they are read with the same start cell.")
     st.markdown("## PPT Template")
     template_chk = st.checkbox("Do you want to upload a custom template file?", key='temp_chk', help="If you don't want to upload a template, a default template will be used.")
     if template_chk:
         st.info('A template basically makes up the initial slides in your final PPT. All the slides will be appended to this template.')
         template_file = st.file_uploader("Upload template PPT file", type=['pptx'], accept_multiple_files=False, key='temp_upl')
-    if template_file:
-        prs = Presentation(template_file)
-    else:
-        prs = Presentation(default_template)
 
     # if uploaded file is present proceed further with the UI
-    if uploaded_file:
+    if uploaded_files:
         st.markdown("## Data fetching 📊")
         
         with st.expander('Want to change default null value replacement for the data?' ):
             global_null_value = st.text_input("Type the replacement value.", value='-', help="[OPTIONAL] All the null values in excel file will be replaced by this character. By Default, they are being replaced by ' -   '. ")
 
-        user_start_location = st.text_input('Enter Start Cell', placeholder='A13', key='user_start_loc',on_change=lambda:remove_keys(['dataframe','headers']),  help="Enter the cell address from where you want the data to be extracted from the excel file.")
-        if user_start_location != "":   
-            
-            # IMPORTANT: Before we understand what session_state is, we need to understand that streamlit
-            # refreshes the entire UI everytime a change is detected in UI elements. So in order to save 
-            # unnecessary recomputation of time expensive events, we can save them as session variables in
-            # session_state dictionary
+        # IMPORTANT: Before we understand what session_state is, we need to understand that streamlit
+        # refreshes the entire UI everytime a change is detected in UI elements. So in order to save 
+        # unnecessary recomputation of time expensive events, we can save them as session variables in
+        # session_state dictionary
 
-            # since data fetching is expensive, we can fetch it once and store it as a session variable
-            # now, everytime the UI refreshes itself the session_state variables are reused instead of recalculation.
+        # The big values(raw sheet and dataframe) are kept in a server wide store instead, which keeps them compact
+        # and evicts the ones of idle sessions when the server runs out of its memory budget.
+        if 'session_key' not in st.session_state:
+            st.session_state['session_key'] = uuid.uuid4().hex
+        session_key = st.session_state['session_key']
+        sessions.touch(session_key)
+
+        # every chosen sheet of every uploaded workbook is a source, by default the first sheet of every workbook
+        if 'sheet_names' not in st.session_state:
+            try:
+                st.session_state['sheet_names'] = [sheet_names(ele) for ele in uploaded_files]
+            except Exception as e:
+                st.error(f"ERROR: The uploaded files could not be read: {e}")
+                st.stop()
+        items = []
+        for i, (file, names) in enumerate(zip(uploaded_files, st.session_state['sheet_names'])):
+            chosen = names[:1]
+            if len(names) > 1:
+                chosen = st.multiselect(f"Sheets of {file.name}", names, names[:1], key='sheets_'+str(i), on_change=lambda:reset_sources(False), help="Every chosen sheet is read with the same start cell.")
+            items += [(i, sheet) for sheet in chosen]
+        if len(items) == 0:
+            st.error("Please select at least 1 sheet.")
+            st.stop()
+        sources = source_names([(uploaded_files[i], sheet) for i, sheet in items])
+        sources_key = repr(list(zip(items, sources)))
+        if len(items) > 1:
+            combine = st.radio("How should the sources be put together?", ['One table with a Source column', 'One deck section per source'], key='combine', help="Either the rows of all the sources are shown together, the Source column tells where every row comes from, or every chart and table is repeated for every source.")
+            if combine == 'One deck section per source':
+                section_by = source_column
+
+        # since parsing the excel files is expensive, the raw sheets are parsed once per upload and stored as session variables.
+        # A new start cell only cuts a different region out of them.
+        # sessions that uploaded the same file share one parsed sheet, they are only looked up when a region has to be cut
+        digests = upload_digests()
+        keys = [cache.make_key(digests[i], sheet, 'grid') for i, sheet in items]
+        st.session_state['grid_names'] = ['grid/' + key for key in keys]
+        if 'detected_start' not in st.session_state:
+            # guess where the data starts, so the start cell can be prefilled
+            detected = detect_header_row(source_grids(items, keys)[0])
+            st.session_state['detected_start'] = '' if detected is None else convert_number_excel_col(detected[1]) + str(detected[0])
+
+        user_start_location = st.text_input('Enter Start Cell', value=st.session_state['detected_start'], placeholder='A13', key='user_start_loc',on_change=lambda:remove_keys(['dataframe','headers','preview']),  help="Enter the cell address from where you want the data to be extracted from the excel file. It is prefilled with the detected position of the column titles.")
+        if user_start_location != "":   
 
             # Fetching data and storing the dataframe as a session variable
-            if 'dataframe' not in st.session_state:
-                # if dataframe is not in session variables, calculate it and store it
-                cols, rows = split_start_address(user_start_location)    
-                beginx = int(rows)
-                beginy = convert_excel_col_number(cols)
-                dataframe = get_data(uploaded_file)
-                dataframe = dataframe.loc[:, dataframe.columns.notna()]
-                dataframe = dataframe.reset_index(drop=True)
+            dataframe = sessions.get(session_key, 'dataframe')
+            if dataframe is None or 'headers' not in st.session_state:
+                # another session may have cut the same region out of the same files already
+                dataframe = sessions.attach(session_key, 'dataframe', data_key('dataframe', sources_key, user_start_location, global_null_value))
+                if dataframe is not None:
+                    st.session_state['headers'] = dataframe.columns.tolist()
+                    st.session_state['preview'] = dataframe.head()
+            if dataframe is None or 'headers' not in st.session_state:
+                # if dataframe is not in session variables, calculate it from the raw sheets and store it
+                dataframe = slice_sources(source_grids(items, keys), sources, user_start_location)
                 headers = dataframe.columns.tolist()
-                st.session_state['dataframe'] = dataframe
+                # the first rows with all the columns are kept for the preview, the dataframe is cut down to the used columns on Submit
+                st.session_state['preview'] = dataframe.head()
+                dataframe = keep('dataframe', dataframe, data_key('dataframe', sources_key, user_start_location, global_null_value))
                 st.session_state['headers'] = headers
+                # stage timings of the load, the parse of the sheet is included when it happened in this run
+                st.session_state['perf_load'] = load_timer.records()
+                if perf_log:
+                    perf.append_log(perf_log, st.session_state['perf_load'], run='load')
             else:
                 # if dataframe is available in session variables, reuse it instead of recalculation
-                dataframe = st.session_state['dataframe']
                 headers = st.session_state['headers']
             
             
 
             st.markdown("## Data Preview 📋")
             
-            display_head = dataframe.head()
+            display_head = st.session_state['preview'] if 'preview' in st.session_state else dataframe.head()
             # Error prone area, The starting address maybe invalid or may contain location that is not valid 
             # or may contain duplicate columns, so handled them here.
             try:
@@ -424,7 +556,7 @@ if __name__ == "__main__":
                     show_this = show_this[:-2]
                     st.error(show_this)
                 else:
-                    _display_head = dataframe[_display_head]
+                    _display_head = display_head[_display_head]
                     st.dataframe(_display_head)
                     st.info("Please verify if all the columns titles are displayed in the preview below, if not please re-enter correct starting cell address.")
             
@@ -436,8 +568,22 @@ if __name__ == "__main__":
                 openCaseCol = st.selectbox('Select the case split column: ', ['<select>'] + headers, help="Enter a column title on the basis of which the segregation will be performed. Usually it is either “Open Days” column or “Open Cases” column")
                 if openCaseCol == '<select>':
                     st.write("Please Select an open case column.")
+                elif st.radio("Split the cases into", ['Open and closed cases', 'Groups'], key='split_mode', help="Groups split the cases into as many sections as needed, e.g. aging bands: > 90, > 30, > 0.") == 'Groups':
+                    grp_num = st.number_input("Enter the number of groups", 1, 100, 3, 1, key="grp_num")
+                    # Every row goes to the first group whose rule it passes
+                    case_groups = []
+                    for i in range(int(grp_num)):
+                        grp_name = st.text_input("Enter title of the group", value="Group "+str(i+1), key="grp_name_"+str(i+1))
+                        grp_rule = st.text_input("Enter the rule of the group", value='non-empty', key="grp_rule_"+str(i+1), help="Cases go to the first group whose rule they pass. A rule can be a value or commas seperated values: -,NO; a threshold: > 30; a range: 30..90; a regular expression: ~ ^ESC; empty or non-empty. Rules can be combined with and, or, not.")
+                        temp, temp_trigger = create_a_multiselect(headers, "grp_"+str(i+1), "Select columns for this group:")
+                        grp_per_slide = st.number_input("Enter number of rows per slide: ", 0, 1000, 6, 1, key="grp_per_slide"+str(i+1))
+                        if len(temp) == 0:
+                            st.error("Please select at least 1 column.")
+                        elif check_rule(grp_rule):
+                            case_groups.append([grp_name, grp_rule, temp, grp_per_slide])
                 else:
-                    global_compare_false_val = st.text_input("Enter the seperation delimiter [Case Sensitive]", value='-', help="The slides will be split based on this delimiter, if entry in a cell equals to this delimiter, it goes onto the closed case slide. It can also be a list of commas seperated values: -,NO,_.").split(',')
+                    global_compare_false_val = st.text_input("Enter the closed case rule [Case Sensitive]", value='-', help="Cases passing this rule go onto the closed case slides. It can be a value or a list of commas seperated values: -,NO,_; a threshold: <= 0; a range: 0..30; a regular expression: ~ ^Closed; empty or non-empty. Rules can be combined with and, or, not.")
+                    check_rule(global_compare_false_val)
 
                     opcsheads, open_case_trigger = create_a_multiselect(headers, "open_cases", "Select column for open case slide: ")
                     op_chk = st.checkbox("Do you want to insert blank columns?", key='op_chkbox', help="Enter the new column title in the space provided below. You can also add multiple columns by separating the titles with commas. For e.g. Col A, Col B.")
@@ -479,10 +625,23 @@ if __name__ == "__main__":
                     
                     sz_per_slide = st.number_input("Enter number of rows per slide: ", 0, 1000, 6, 1, key="sz_per_slide"+str(i+1))
 
+                    # the rows are filtered, sorted and cut down before they are extracted, only the kept rows are rendered
+                    row_filter, sort, top = None, None, None
+                    if st.checkbox("Do you want to filter, sort or limit the rows?", key='tab_opts_'+str(i+1), help="Only the rows that are kept are rendered, e.g. the top 10 escalations out of thousands of rows."):
+                        filter_col = st.selectbox("Filter by column:", ['<none>'] + headers, key="tab_fcol_"+str(i+1))
+                        if filter_col != '<none>':
+                            filter_rule = st.text_input("Keep the rows passing this rule", value='non-empty', key="tab_frule_"+str(i+1), help="A rule can be a value or commas seperated values: -,NO; a threshold: > 30; a range: 30..90; a regular expression: ~ ^ESC; empty or non-empty. Rules can be combined with and, or, not.")
+                            if check_rule(filter_rule):
+                                row_filter = [filter_col, filter_rule]
+                        sort_col = st.selectbox("Sort by column:", ['<none>'] + headers, key="tab_scol_"+str(i+1), help="Numbers are sorted by value, other columns as text.")
+                        if sort_col != '<none>':
+                            sort = [sort_col, st.radio("Order", ['Descending', 'Ascending'], key="tab_sord_"+str(i+1)) == 'Descending']
+                        top = int(st.number_input("Keep only the first rows(0 for all): ", 0, 10**7, 0, 1, key="tab_top_"+str(i+1))) or None
+
                     if len(temp) == 0:
                         st.error("Please select at least 1 column.")
                     else:
-                        ext_tab_arr.append([temp, tab_name, sz_per_slide])
+                        ext_tab_arr.append([temp, tab_name, sz_per_slide, row_filter, sort, top])
 
             # Charts
             with st.expander("Do you want to add charts?"):
@@ -492,18 +651,45 @@ if __name__ == "__main__":
                     ext_num_c = int(ext_num_c)
                 except:
                     ext_num_c = 0
-                choices_of_charts = ['Pie', 'Bar','Donut']
+                choices_of_charts = ['Pie', 'Bar','Donut', 'Stacked Bar', 'Clustered Bar']
                 ext_cha_arr = []
                 for i in range(ext_num_c):
                     cha_name = st.text_input("Enter chart name",value="Chart "+str(i+1), key="cha_name_"+str(i+1))
                     temp = st.selectbox("Select column for this chart:", headers, key="cha_"+str(i+1), help='The chart will be created based on data of this column.')
                     type_of_chart = st.selectbox('Choose the type of chart.', choices_of_charts, key="cha_choices_"+str(i+1))
-                    ext_cha_arr.append([temp, type_of_chart,cha_name])
+                    group_col = None
+                    if type_of_chart in ('Stacked Bar', 'Clustered Bar'):
+                        group_col = st.selectbox("Select column to split the bars by:", headers, key="cha_group_"+str(i+1), help='Every value of this column becomes a separate series of the chart.')
+                    ext_cha_arr.append([temp, type_of_chart,cha_name, group_col])
 
             st.markdown("## Submit and create PPT ✔️")
             # Button to submit UI data for PPT creation
+            parallel_render = st.checkbox("Render slides in parallel", key='par_render', help="Splits the slides over the cores no other render is using, useful for decks with thousands of slides.")
+            streaming_output = st.checkbox("Low memory mode", key='stream_out', help="Writes every slide to the PPT as soon as it is ready, useful for decks with thousands of slides. Unchanged sections of an earlier submit are rendered again in this mode.")
+            chart_workbooks = not st.checkbox("Lightweight charts", key='light_charts', help="Charts only hold the values they show, without an embedded Excel workbook. Decks with many charts are built faster and are a lot smaller, but the data of the charts can not be edited in PowerPoint.")
+            profile_render = st.checkbox("Profile the render", key='profile_chk', help="Records where the time and the memory of the render go, the report can be downloaded from the Performance section and attached to bug reports.")
             butt_trigger = st.button('Submit')
             if butt_trigger:
-                commence_ppt_creation()
-
-components.html("<!-- HVLC was here -->")
+                # second phase load: only the columns used by the deck are kept in the session copy,
+                # columns missing from an earlier projection are cut out of the raw sheets again
+                used = deck_columns()
+                if any(ele in headers and ele not in dataframe.columns for ele in used):
+                    dataframe = slice_sources(source_grids(items, keys), sources, user_start_location, used)
+                dataframe = keep('dataframe', project_columns(dataframe, used), data_key('dataframe', sources_key, user_start_location, global_null_value, *used))
+                # the raw sheets are only needed again for another start cell or another column, they are released
+                # and the memory budget of the server evicts them first(see sessions._evict)
+                sessions.drop(session_key, st.session_state['grid_names'])
+                # a render still running for this session is replaced by the new one
+                if 'render_job' in st.session_state:
+                    st.session_state['render_job'].cancel()
+                commence_ppt_creation(dataframe)
+
+            # the render runs in the background and is followed across reruns of the script
+            if 'render_job' in st.session_state:
+                show_render_job(st.session_state['render_job'])
+            if 'render_output' in st.session_state:
+                show_render_output()
+            if 'perf_load' in st.session_state or 'perf_render' in st.session_state:
+                show_performance()
+
+# HVLC was here
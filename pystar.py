@@ -0,0 +1,170 @@
+"""
+Headless entry point, renders decks from job files without the UI.
+
+    python -m pystar render jobs/*.json
+
+A job file is a JSON object holding the settings the UI collects, named like the globals of main.py, plus the files:
+    {
+        "input": "reports/emea.xlsx",
+        "output": "decks/emea.pptx",
+        "template": "data/template.pptx",
+        "sheet": 0,
+        "user_start_location": "A13",
+        "global_null_value": "-",
+        "openCaseCol": "Open Days",
+        "global_compare_false_val": "-",
+        "opcsheads": ["Case", "Owner"],
+        "cscsheads": ["Case"],
+        "openCase_rows_per_slide": 6,
+        "closeCase_rows_per_slide": 6,
+        "case_groups": [],
+        "ext_tab_arr": [[["Case", "Region"], "Table 1", 6]],
+        "ext_cha_arr": [["Region", "Pie", "Chart 1", null]],
+        "chart_workbooks": true,
+        "section_by": null
+    }
+Relative paths are taken relative to the job file. "template" and the settings are optional.
+"input" may be an Excel, CSV, Parquet or Feather file. "input" and "sheet" may be lists, e.g. one workbook per region:
+the sources are read at once and put below each other, with a "Source" column naming the file(or sheet) of every row.
+"section_by": "Source" renders one deck section per source.
+"global_compare_false_val" is a list of values or a rule, e.g. "<= 0"(see src/predicates.py). "case_groups" split the cases
+into more groups instead, e.g. [["Over 90 days", "> 90", ["Case"], 6], ["Over 30 days", "> 30", ["Case"], 6]].
+An extra table may filter, sort and limit its rows(see pipeline.select_rows), e.g. the top 10 escalations by days open:
+[["Case", "Open Days"], "Top escalations", 10, ["Status", "~ ^ESC"], ["Open Days", true], 10].
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import pipeline, perf
+from src.render import template_bytes
+
+default_template = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'template.pptx')
+
+
+def load_job(path):
+    """
+    Read a job file.
+
+    @param path: Path to the job file.
+    @return: (deck configuration, input path(or @Array of them), output path, template path, sheet(or @Array of them))
+    """
+    with open(path, encoding='utf-8') as f:
+        job = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    config = pipeline.default_config()
+    for key in config:
+        if key in job:
+            config[key] = job[key]
+    if isinstance(job['input'], list):
+        input_file = [os.path.join(base, ele) for ele in job['input']]
+    else:
+        input_file = os.path.join(base, job['input'])
+    output = os.path.join(base, job.get('output', os.path.splitext(os.path.basename(path))[0] + '.pptx'))
+    template = os.path.join(base, job['template']) if job.get('template') else default_template
+    return config, input_file, output, template, job.get('sheet', 0)
+
+def run_job(path, parallel=False, workers=None, streaming=False, incremental=False, reuse=False):
+    """
+    Render the deck of one job file.
+
+    @param path: Path to the job file.
+    @param parallel: Render the slides of the deck on a process pool.
+    @param workers: Number of processes used when @param parallel is True.
+    @param streaming: Write slides to the output file as they are rendered.
+    @param incremental: Reuse the slides of the sections rendered by an earlier run, see pipeline.render_deck.
+    @param reuse: Copy the deck from the on disk cache when the same data, template and settings were rendered before.
+    @return: dict with the timings of the job and of its stages, or the error when it failed.
+    """
+    result = {'job': path, 'ok': False}
+    start = time.perf_counter()
+    try:
+        config, input_file, output, template, sheet = load_job(path)
+        result['output'] = output
+
+        timer = perf.Timer()
+        df = pipeline.load_data(input_file, config, sheet, timer)
+        result['read_seconds'] = round(time.perf_counter() - start, 3)
+        result['rows'] = len(df)
+
+        out_dir = os.path.dirname(output)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        result['slides'] = pipeline.render_deck(df, config, template_bytes(template), output, parallel, workers, streaming, timer=timer, incremental=incremental, reuse=reuse)
+        result['stages'] = timer.records()
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+def render(jobs, workers=None, report=None, parallel_slides=False, streaming=False, incremental=False, reuse=False):
+    """
+    Render many jobs concurrently on a process pool and print the timing of every job as it finishes.
+
+    @param jobs: @Array of job files, glob patterns are expanded.
+    @param workers: Number of jobs rendered at once, None for one per core(one at a time with @param parallel_slides).
+    @param report: [Optional] Path of a JSON file the results are written to.
+    @param parallel_slides: Render the slides of every deck on a process pool as well, on the cores left over by @param workers.
+    @param streaming: Write slides to the output files as they are rendered.
+    @param incremental: Reuse the slides of the sections rendered by an earlier run.
+    @param reuse: Copy the decks rendered before from the same data, template and settings from the on disk cache.
+    @return: @Array of results, see run_job
+    """
+    paths = []
+    for ele in jobs:
+        paths += sorted(glob.glob(ele)) if glob.has_magic(ele) else [ele]
+
+    # the decks rendered at once share the cores, so parallel slides never start more processes than there are cores.
+    # Without @param workers the decks are rendered one after another, each on all the cores
+    cores = os.cpu_count() or 1
+    if parallel_slides and workers is None:
+        workers = 1
+    slide_workers = max(1, cores//(workers or cores))
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(run_job, path, parallel_slides, slide_workers, streaming, incremental, reuse) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['ok']:
+                print('ok      %7.2fs  %6d rows  %6d slides  %s' % (result['seconds'], result['rows'], result['slides'], result['job']))
+            else:
+                print('FAILED  %7.2fs  %s: %s' % (result['seconds'], result['job'], result['error']))
+    failed = [ele for ele in results if not ele['ok']]
+    print('%d jobs, %d failed, %.2fs' % (len(results), len(failed), time.perf_counter() - start))
+
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pystar', description='Render PPT decks from Excel files without the UI.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    render_parser = commands.add_parser('render', help='Render decks from job files.')
+    render_parser.add_argument('jobs', nargs='+', help='Job files(JSON), e.g. jobs/*.json')
+    render_parser.add_argument('--workers', type=int, default=None, help='Number of decks rendered at once, defaults to one per core(one with --parallel-slides).')
+    render_parser.add_argument('--report', default=None, help='Write the per job timings and failures to this JSON file.')
+    render_parser.add_argument('--parallel-slides', action='store_true', help='Render the slides of each deck on a process pool as well.')
+    render_parser.add_argument('--low-memory', action='store_true', help='Write slides to the output files as they are rendered.')
+    render_parser.add_argument('--incremental', action='store_true', help='Reuse the slides of the sections that did not change since an earlier run.')
+    render_parser.add_argument('--reuse', action='store_true', help='Copy the decks rendered before from the same data, template and settings from the cache.')
+
+    args = parser.parse_args(argv)
+    if args.command == 'render':
+        results = render(args.jobs, args.workers, args.report, args.parallel_slides, args.low_memory, args.incremental, args.reuse)
+        return 1 if any(not ele['ok'] for ele in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from io import BytesIO
+
+# Pandas for dataframes
+import pandas as pd
+
+# for pptx
+from pptx import Presentation
+
+# pyarrow is optional, without it the on disk cache is simply switched off
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+cache_dir = '.pystar_cache'    # Directory in which parsed workbooks are stored
+cache_max_bytes = 2*1024**3    # Size limit of the cache directory, least recently used entries are evicted beyond this
+template_cache_size = 8    # Number of parsed templates kept in memory
+
+# parsed templates by content hash, least recently used first
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+
+
+def file_digest(file):
+    """
+    Content hash of an uploaded file.
+
+    @param file: Path, bytes or file object(e.g. Streamlit UploadedFile).
+    @return: Hex digest of the file contents.
+    """
+    if isinstance(file, bytes):
+        data = file
+    elif hasattr(file, 'getvalue'):
+        data = file.getvalue()
+    elif hasattr(file, 'read'):
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+    else:
+        with open(file, 'rb') as f:
+            data = f.read()
+    return hashlib.sha256(data).hexdigest()
+
+def make_key(*parts):
+    """
+    Build a cache key out of @param parts, e.g. make_key(digest, sheet).
+
+    @return: Hex digest that can be used as a file name.
+    """
+    return hashlib.sha256('\x00'.join(str(ele) for ele in parts).encode('utf-8')).hexdigest()
+
+def _entry_path(key, ext):
+    return os.path.join(cache_dir, key + ext)
+
+def _touch(path):
+    # last access time is kept as the modification time, it drives the LRU eviction
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def evict(max_bytes=None):
+    """
+    Remove least recently used entries until the cache directory fits into @param max_bytes.
+
+    @param max_bytes: Size budget in bytes, defaults to cache_max_bytes.
+    """
+    if max_bytes is None:
+        max_bytes = cache_max_bytes
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append([st.st_mtime, st.st_size, path])
+    total = sum(ele[1] for ele in entries)
+    # oldest entries first
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def load_frame(key):
+    """
+    Load a dataframe from the cache. The file is memory mapped, so a hit costs only a few milliseconds.
+
+    @param key: Cache key
+    @return: Pandas dataframe or None on a miss.
+    """
+    if feather is None:
+        return None
+    path = _entry_path(key, '.feather')
+    if not os.path.exists(path):
+        return None
+    try:
+        df = feather.read_table(path, memory_map=True).to_pandas()
+    except Exception:
+        # corrupt or partially written entry, treat it as a miss
+        return None
+    _touch(path)
+    # column names are stored as strings, positional names are restored
+    df.columns = [int(ele) if ele.isdigit() else ele for ele in df.columns]
+    return df
+
+def store_frame(key, df):
+    """
+    Store a dataframe in the cache in a columnar binary format and evict old entries if needed.
+
+    @param key: Cache key
+    @param df: Pandas dataframe with unique column names.
+    """
+    if feather is None:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _entry_path(key, '.feather')
+        # write to a temporary file first so that readers never see a partial entry
+        tmp = path + '.tmp' + str(os.getpid())
+        out = df.copy(deep=False)
+        out.columns = [str(ele) for ele in out.columns]
+        feather.write_feather(out, tmp, compression='uncompressed')
+        os.replace(tmp, path)
+    except Exception:
+        # the cache is an optimisation only, failing to write it must never fail the request
+        return
+    evict()
+
+def load_blob(key, ext):
+    """
+    Load a file from the cache.
+
+    @param key: Cache key
+    @param ext: Extension of the entry, e.g. .pptx
+    @return: Bytes of the entry or None on a miss.
+    """
+    path = _entry_path(key, ext)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    _touch(path)
+    return data
+
+def store_blob(key, data, ext):
+    """
+    Store a file in the cache and evict old entries if needed.
+
+    @param key: Cache key
+    @param data: Bytes of the entry.
+    @param ext: Extension of the entry, e.g. .pptx
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _entry_path(key, ext)
+        # write to a temporary file first so that readers never see a partial entry
+        tmp = path + '.tmp' + str(os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        # the cache is an optimisation only, failing to write it must never fail the request
+        return
+    evict()
+
+def column_digest(column):
+    """
+    Fingerprint of the contents of a column, equal columns give equal fingerprints.
+
+    @param column: Pandas series
+    @return: Hex digest of the values(in order) and the dtype of the column.
+    """
+    values = pd.util.hash_pandas_object(column, index=False).values
+    return make_key(str(column.dtype), hashlib.sha256(values.tobytes()).hexdigest())
+
+def load_template(template):
+    """
+    Presentation made from a template, the template is parsed once per process and every call gets its own copy.
+    Copying the parsed template is about twice as fast as parsing it again, see the stages load_template and parse_template
+    of bench.py.
+
+    @param template: Bytes of the template pptx file.
+    @return: PPT Presentation object that can be changed freely.
+    """
+    key = hashlib.sha256(template).hexdigest()
+    with _templates_lock:
+        master = _templates.get(key)
+        if master is not None:
+            _templates.move_to_end(key)
+    if master is None:
+        master = Presentation(BytesIO(template))
+        with _templates_lock:
+            _templates[key] = master
+            while len(_templates) > template_cache_size:
+                _templates.popitem(last=False)
+    return deepcopy(master)
@@ -0,0 +1,448 @@
+import os
+import csv
+import multiprocessing
+from io import BytesIO, StringIO
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# Pandas for dataframes
+import pandas as pd
+import numpy as np
+
+# for excel
+from openpyxl import load_workbook
+
+# pyarrow is optional, without it compact_frame keeps high cardinality columns as Python strings,
+# CSV files are parsed on one thread and Parquet/Feather files can not be read
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+category_ratio = 0.5    # compact_frame stores columns with fewer distinct values than this share of their rows as categoricals
+source_column = 'Source'    # Column added by concat_sources, it names the workbook or sheet every row comes from
+grid_gap_rows = 1000    # read_excel_grid stops after this many empty rows in a row below the data, e.g. formatted but empty rows
+table_formats = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}    # Inputs read by read_table_grid, by file extension
+
+
+def _convert_cell(value, global_null_value='-'):
+    """
+    Convert a raw openpyxl cell value into the string stored in the dataframe.
+    Mirrors what pd.read_excel(dtype=str) produces, e.g. 12.0 -> '12'.
+
+    @param value: Raw cell value as returned by openpyxl.
+    @param global_null_value: Value used for empty cells.
+    @return: String representation of the cell.
+    """
+    if value is None:
+        return global_null_value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value)
+    if value == '':
+        return global_null_value
+    return value
+
+def read_excel_region(file, beginx, beginy, global_null_value='-', sheet=0, usecols=None):
+    """
+    Stream the used region of a sheet of an Excel file into a dataframe.
+    The sheet is opened in read-only mode and read row by row starting at the start cell,
+    the row at the start cell is used as the column titles and reading stops at the first fully empty row.
+    Rows above and columns left of the start cell are never parsed.
+
+    @param file: Path or file object of the excel file
+    @param beginx: Row number(1-based) of the start cell, e.g. 13 for A13
+    @param beginy: Column number(1-based) of the start cell, e.g. 1 for A13
+    @param global_null_value: Value used for empty cells.
+    @param sheet: Index or name of the sheet to be read.
+    @param usecols: [Optional] Column titles to be read, cells of other columns are never converted.
+    @return: Pandas dataframe
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet] if isinstance(sheet, int) else wb[sheet]
+        min_col = max(1, beginy)
+        header = list(next(ws.iter_rows(min_row=max(1, beginx), max_row=max(1, beginx), min_col=min_col, values_only=True), ()))
+
+        # first row of the region makes up the column titles, trailing empty titles are dropped
+        while len(header) > 0 and header[-1] is None:
+            header.pop()
+        m = len(header)
+        titles = [np.nan if ele is None else _convert_cell(ele) for ele in header]
+
+        # positions of the columns to be kept
+        keep = list(range(m))
+        if usecols is not None:
+            keep = [j for j in keep if titles[j] in usecols]
+
+        # data is collected column by column, so the dataframe is built without a per row object
+        columns = [[] for _ in keep]
+        for row in ws.iter_rows(min_row=max(1, beginx)+1, min_col=min_col, max_col=min_col+m-1, values_only=True):
+            # the end of the region is decided on all the columns, not only the kept ones
+            if all(ele is None or ele == '' for ele in row[:m]):
+                break
+            for k, j in enumerate(keep):
+                columns[k].append(_convert_cell(row[j], global_null_value) if j < len(row) else global_null_value)
+    finally:
+        wb.close()
+
+    df = pd.DataFrame({k: pd.Series(columns[k], dtype=object) for k in range(len(keep))})
+    # Empty titles are kept as nan, so that they can be dropped like the ones from pd.read_excel
+    df.columns = [titles[j] for j in keep]
+    return df
+
+def read_excel_grid(file, sheet=0):
+    """
+    Stream a whole sheet of an Excel file into a raw grid, without any header or offset handling.
+    Cells are stored as strings, empty cells are kept as None so that the null value can be chosen later.
+    Columns are named by their position(0 for column A), rows by their position(0 for row 1).
+    Reading stops at the end of the sheet or after grid_gap_rows empty rows below the data, trailing empty rows are not kept.
+
+    @param file: Path or file object of the excel file
+    @param sheet: Index or name of the sheet to be read.
+    @return: Pandas dataframe holding the raw grid.
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet] if isinstance(sheet, int) else wb[sheet]
+        columns = []
+        n = 0    # number of rows stored so far
+        gap = 0    # empty rows read since the last non empty row, they are stored once a non empty row follows
+        for row in ws.iter_rows(values_only=True):
+            if not any(ele is not None and ele != '' for ele in row):
+                gap += 1
+                if n > 0 and gap >= grid_gap_rows:
+                    break
+                continue
+            # new columns are back filled with empty cells, so are the empty rows before this one
+            while len(columns) < len(row):
+                columns.append([None]*n)
+            n += gap + 1
+            for j in range(len(columns)):
+                columns[j].extend([None]*gap)
+                columns[j].append(_convert_cell(row[j], None) if j < len(row) else None)
+            gap = 0
+    finally:
+        wb.close()
+
+    return pd.DataFrame({j: pd.Series(columns[j], dtype=object) for j in range(len(columns))})
+
+def input_format(file):
+    """
+    Format of an input file, told by its extension.
+
+    @param file: Path or file object with a name(e.g. Streamlit UploadedFile).
+    @return: 'csv', 'parquet', 'feather', or 'excel' for anything else.
+    """
+    name = str(getattr(file, 'name', file))
+    return table_formats.get(os.path.splitext(name)[1].lower(), 'excel')
+
+def _arrow_source(file):
+    # paths are memory mapped by pyarrow, uploads are wrapped without copying their bytes
+    if hasattr(file, 'getvalue'):
+        return pyarrow.BufferReader(file.getvalue())
+    if hasattr(file, 'read'):
+        file.seek(0)
+        return pyarrow.BufferReader(file.read())
+    return file
+
+def _table_column(col):
+    # typed column of a Parquet or Feather file as strings, converted like the cells of a workbook(e.g. 12.0 -> '12')
+    if pd.api.types.is_string_dtype(col):
+        return col.to_numpy(dtype=object)
+    return col.map(lambda value: _convert_cell(value, None), na_action='ignore').to_numpy(dtype=object)
+
+def _file_bytes(file):
+    # contents of a path or a file object
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    if hasattr(file, 'read'):
+        file.seek(0)
+        return file.read()
+    with open(file, 'rb') as f:
+        return f.read()
+
+def _decode_text(data):
+    # CSV exports are UTF-8, or cp1252 when saved by Excel on Windows. latin-1 takes any byte, so decoding never fails
+    for encoding in ('utf-8-sig', 'cp1252'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode('latin-1')
+
+def _read_csv_grid(data):
+    """
+    Parse a CSV file into a raw grid, every line of the file is a row of the grid(blank lines included),
+    so that the start cell points at the same row as in a spreadsheet. Only empty fields are empty cells,
+    texts like NA are kept as they are. Files that are not UTF-8 are read as cp1252(Excel exports on Windows).
+
+    @param data: Bytes of the CSV file.
+    @return: Pandas dataframe holding the raw grid, columns and rows named by their position.
+    """
+    # fast path: the pyarrow parser is multi-threaded, but it skips blank lines and needs every line to be as wide
+    # as the first one, so it only reads rectangular files without blank lines(e.g. exports without a title above the table)
+    blank = data[:1] in (b'\n', b'\r') or b'\n\n' in data or b'\n\r\n' in data
+    if pyarrow is not None and not blank:
+        try:
+            return pd.read_csv(BytesIO(data), header=None, dtype=str, engine='pyarrow', keep_default_na=False, na_values=[''])
+        except (pd.errors.ParserError, pyarrow.ArrowInvalid, UnicodeDecodeError):
+            pass
+
+    # ragged or padded files(e.g. a report title above the table) are read line by line, short lines are padded with empty cells
+    rows = list(csv.reader(StringIO(_decode_text(data), newline='')))
+    grid = pd.DataFrame(rows, dtype=object) if rows else pd.DataFrame()
+    return grid.mask(grid == '')
+
+def read_table_grid(file, sheet=0):
+    """
+    Read a CSV, Parquet or Feather file into a raw grid, like read_excel_grid does for a sheet of a workbook.
+    CSV files keep every line as a row(see _read_csv_grid), every field is kept as text.
+    Parquet and Feather files are read through Arrow(memory mapped when given as a path), their column names make up
+    the first row of the grid and their values are converted to strings.
+
+    @param file: Path or file object of the file, the format is told by its name(see input_format).
+    @param sheet: Not used, these files have a single table.
+    @return: Pandas dataframe holding the raw grid.
+    """
+    fmt = input_format(file)
+    if fmt == 'csv':
+        grid = _read_csv_grid(_file_bytes(file))
+    else:
+        if pyarrow is None:
+            raise ImportError('Reading %s files needs pyarrow' % fmt.capitalize())
+        if fmt == 'parquet':
+            table = pyarrow.parquet.read_table(_arrow_source(file), memory_map=True)
+        else:
+            table = pyarrow.feather.read_table(_arrow_source(file), memory_map=True)
+        df = table.to_pandas()
+        grid = pd.DataFrame({j: pd.Series(np.concatenate(([str(df.columns[j])], _table_column(df.iloc[:, j]))), dtype=object) for j in range(df.shape[1])})
+
+    # trailing empty rows are dropped
+    filled = grid.notna().any(axis=1).to_numpy()
+    used = len(filled) - int(filled[::-1].argmax()) if filled.any() else 0
+    grid = grid.iloc[:used]
+    grid.columns = range(grid.shape[1])
+    return grid
+
+def read_grid(file, sheet=0):
+    """
+    Raw grid of any supported input: read_excel_grid for workbooks, read_table_grid for CSV, Parquet and Feather files.
+    """
+    if input_format(file) == 'excel':
+        return read_excel_grid(file, sheet)
+    return read_table_grid(file, sheet)
+
+def read_region(file, beginx, beginy, global_null_value='-', sheet=0, usecols=None):
+    """
+    Data region of any supported input, see read_excel_region.
+    CSV, Parquet and Feather files are read whole, the start cell and the null value are applied by slice_region.
+    """
+    if input_format(file) == 'excel':
+        return read_excel_region(file, beginx, beginy, global_null_value, sheet, usecols)
+    return slice_region(read_table_grid(file, sheet), beginx, beginy, global_null_value, usecols)
+
+def sheet_names(file):
+    """
+    Names of the sheets of an Excel file, only the list of sheets is parsed.
+    Other inputs have a single table, named 0.
+
+    @param file: Path or file object of the excel file
+    @return: @Array of sheet names, in workbook order.
+    """
+    if input_format(file) != 'excel':
+        return [0]
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    wb = load_workbook(file, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def _read_source(reader, kwargs, file, sheet):
+    # worker side of read_concurrently, uploads arrive as (name, bytes)
+    if isinstance(file, tuple):
+        name, file = file
+        file = BytesIO(file)
+        file.name = name
+    return reader(file, sheet=sheet, **kwargs)
+
+def read_concurrently(items, reader=read_grid, workers=None, **kwargs):
+    """
+    Parse several sheets at once, so that the wall time is about the one of the slowest sheet instead of the sum.
+    openpyxl is pure Python, the sheets are parsed on a process pool rather than on threads.
+
+    @param items: @Array of (file, sheet), files are paths or file objects(e.g. Streamlit UploadedFile).
+    @param reader: read_grid or read_region, called as reader(file, sheet=sheet, **kwargs).
+    @param workers: Number of processes, None for one per core.
+    @return: @Array of dataframes, in the order of @param items.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(items)))
+    if workers <= 1:
+        return [reader(file, sheet=sheet, **kwargs) for file, sheet in items]
+
+    # file objects can not be sent to other processes, their names and contents are sent instead
+    files = []
+    for file, sheet in items:
+        if hasattr(file, 'getvalue'):
+            file = (getattr(file, 'name', ''), file.getvalue())
+        elif hasattr(file, 'read'):
+            file.seek(0)
+            file = (getattr(file, 'name', ''), file.read())
+        files.append(file)
+    # workers are started with spawn, forking the multi-threaded Streamlit server is not safe(see jobs.get_pool)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(partial(_read_source, reader, kwargs), files, [sheet for file, sheet in items]))
+
+def source_names(items):
+    """
+    Names of the sources of a multi file or multi sheet upload, as shown in the source column:
+    the name of the file, the name of the sheet when all the sheets come from one file, or both.
+
+    @param items: @Array of (file, sheet), files are paths or file objects with a name.
+    @return: @Array of names, in the order of @param items.
+    """
+    files = [str(getattr(file, 'name', file)) for file, sheet in items]
+    names = []
+    for (file, sheet), name in zip(items, files):
+        stem = os.path.splitext(os.path.basename(name))[0]
+        if files.count(name) == 1:
+            names.append(stem)
+        elif len(set(files)) == 1:
+            names.append(str(sheet))
+        else:
+            names.append('%s / %s' % (stem, sheet))
+    return names
+
+def concat_sources(frames, names, global_null_value='-'):
+    """
+    Put the data of several sources(workbooks or sheets) below each other.
+    The column source_column, put first, tells where every row comes from. Columns missing from a source are filled with the null value.
+
+    @param frames: @Array of dataframes, e.g. as returned by slice_region.
+    @param names: @Array of names of the sources, see source_names.
+    @param global_null_value: Value used for the columns missing from a source.
+    @return: Pandas dataframe
+    """
+    parts = []
+    for df, name in zip(frames, names):
+        df = df.loc[:, df.columns != source_column].reset_index(drop=True)
+        df.insert(0, source_column, name)
+        parts.append(df)
+    # columns are kept in order of first appearance
+    return pd.concat(parts, ignore_index=True, sort=False).fillna(global_null_value)
+
+def slice_region(grid, beginx, beginy, global_null_value='-', usecols=None):
+    """
+    Cut the data region starting at the start cell out of a raw grid.
+    The row at the start cell is used as the column titles and the region ends at the first fully empty row.
+
+    @param grid: Raw grid as returned by read_excel_grid.
+    @param beginx: Row number(1-based) of the start cell, e.g. 13 for A13
+    @param beginy: Column number(1-based) of the start cell, e.g. 1 for A13
+    @param global_null_value: Empty cells are replaced by this value.
+    @param usecols: [Optional] Column titles to be kept, other columns are dropped before null replacement.
+    @return: Pandas dataframe
+    """
+    region = grid.iloc[max(0, beginx-1):, max(0, beginy-1):]
+    if len(region) == 0:
+        return pd.DataFrame()
+
+    # first row of the region makes up the column titles, trailing empty titles are dropped
+    header = [None if pd.isna(ele) else ele for ele in region.iloc[0].tolist()]
+    while len(header) > 0 and header[-1] is None:
+        header.pop()
+    m = len(header)
+
+    # the region ends at the first fully empty row
+    body = region.iloc[1:, :m]
+    empty_rows = body.isna().all(axis=1).to_numpy()
+    if empty_rows.any():
+        body = body.iloc[:empty_rows.argmax()]
+
+    titles = [np.nan if ele is None else ele for ele in header]
+    if usecols is not None:
+        keep = [j for j in range(m) if titles[j] in usecols]
+        body = body.iloc[:, keep]
+        titles = [titles[j] for j in keep]
+
+    # a compacted grid(see compact_frame) is turned back into plain strings before the null value is filled in
+    df = body.astype(object).fillna(global_null_value).reset_index(drop=True)
+    # Empty titles are kept as nan, so that they can be dropped like the ones from pd.read_excel
+    df.columns = titles
+    return df
+
+def compact_frame(df):
+    """
+    Compact copy of a dataframe of strings, for dataframes kept in memory for the lifetime of a session.
+    Low cardinality columns are dictionary encoded(categoricals), so every distinct value, the null value included, is stored once.
+    The other columns are stored as Arrow backed strings, one buffer per column instead of one Python object per cell.
+    Values are not changed, only the way they are stored.
+
+    @param df: Dataframe object, e.g. as returned by slice_region or read_excel_grid.
+    @return: Pandas dataframe
+    """
+    columns = []
+    for j in range(df.shape[1]):
+        # columns are taken by position, titles may be duplicated or nan
+        col = df.iloc[:, j]
+        # only plain string columns are converted, anything else is kept as it is
+        if (col.dtype == object or isinstance(col.dtype, pd.StringDtype)) and pd.api.types.infer_dtype(col, skipna=True) in ('string', 'empty'):
+            if col.nunique(dropna=False) <= category_ratio*len(col):
+                col = col.astype('category')
+            elif pyarrow is not None:
+                col = col.astype('string[pyarrow]')
+        columns.append(col.reset_index(drop=True))
+    out = pd.DataFrame(dict(enumerate(columns)))
+    out.index = df.index
+    out.columns = df.columns
+    return out
+
+def project_columns(df, usecols):
+    """
+    Drop every column of @param df that is not in @param usecols.
+
+    @param df: Dataframe object.
+    @param usecols: Column titles to be kept.
+    @return: Pandas dataframe with only the kept columns.
+    """
+    return df.loc[:, df.columns.isin(list(usecols))].copy()
+
+def detect_header_row(grid, n=20):
+    """
+    Guess the start cell of the data by looking at the first @param n rows of a raw grid.
+    The header is taken to be the first row that is about as wide as the widest row, has distinct
+    mostly non numeric titles and is followed by a non empty row.
+
+    @param grid: Raw grid as returned by read_excel_grid.
+    @param n: Number of rows to be looked at.
+    @return: (row, col) 1-based address of the start cell, or None if nothing looks like a header.
+    """
+    head = grid.iloc[:n+1]
+    filled = head.notna().to_numpy()
+    counts = filled.sum(axis=1)
+    if len(counts) == 0 or counts.max() == 0:
+        return None
+    widest = counts[:n].max()
+
+    for i in range(min(n, len(head)-1)):
+        # too narrow, e.g. a report title or a note above the table
+        if counts[i] == 0 or counts[i] < 0.8*widest or counts[i+1] == 0:
+            continue
+        values = head.iloc[i][filled[i]]
+        if values.nunique() != len(values):
+            continue
+        numeric = pd.to_numeric(values, errors='coerce').notna().sum()
+        if numeric > len(values)/2:
+            continue
+        return i+1, int(filled[i].argmax())+1
+    return None
@@ -0,0 +1,232 @@
+import os
+import time
+import uuid
+import threading
+import cProfile
+import tracemalloc
+import multiprocessing
+from copy import deepcopy
+from io import BytesIO
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from src import pipeline, perf
+
+max_running = os.cpu_count() or 1    # Number of decks rendered at the same time by the server, a parallel render takes the cores no other job uses when it starts
+max_queued = 2*max_running    # Number of decks waiting for a free worker, submissions beyond this are refused
+
+# shared by all the sessions of the server, made on first use
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+_manager = None
+_cores = None
+
+
+class QueueFull(Exception):
+    """
+    Raised when the render queue of the server is full.
+    """
+    pass
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job when it was cancelled, or abandoned by the session that submitted it.
+    """
+    pass
+
+
+class RenderJob:
+    """
+    Everything needed to render one deck: deck configuration, data and template.
+    A job owns copies of its inputs, so it never changes the dataframe of a session and
+    several jobs can run next to each other.
+    """
+
+    def __init__(self, dataframe, config, template, parallel=False, workers=None, streaming=False, limit=-1, abandon_after=None, profile=False, incremental=False, reuse=False):
+        """
+        @param dataframe: Data of the deck, the job works on its own shallow copy.
+        @param config: Deck configuration, see pipeline.default_config.
+        @param template: Bytes of the template pptx file.
+        @param parallel: Render the slides of the deck on a process pool, see render_parallel.
+        @param workers: Number of processes used when @param parallel is True, capped by the cores that are idle when the job starts.
+        @param streaming: Write slides to the output as they are rendered, see StreamingPptxWriter.
+        @param limit: Dev mode only, maximum number of rows per table.
+        @param abandon_after: [Optional] Seconds without a heartbeat() after which the job stops by itself, None to never stop.
+        @param profile: Run the render under cProfile and track the memory of every stage, the report is returned with the result.
+        @param incremental: Reuse the slides of the sections that did not change since an earlier render, see pipeline.render_deck.
+        @param reuse: Serve the deck from the on disk cache when the same data, template and settings were rendered before, see pipeline.deck_key.
+                Profiled jobs are always rendered.
+        """
+        # columns added while rendering(blank columns of the tables) only go into the copy
+        self.dataframe = dataframe.copy(deep=False)
+        self.config = deepcopy(config)
+        self.template = template
+        self.parallel = parallel
+        self.workers = workers
+        self.streaming = streaming
+        self.limit = limit
+        self.abandon_after = abandon_after
+        self.profile = profile
+        self.incremental = incremental
+        self.reuse = reuse
+        self.future = None    # set by submit()
+        self.id = uuid.uuid4().hex
+        # processes rendering by job, shared by all the jobs of the server, see _claim_cores
+        self.cores, self.cores_lock = get_cores()
+        # progress and cancellation, shared between the session and the worker rendering the job
+        self.status = get_manager().dict(done=0, total=0, cancelled=False, heartbeat=time.time())
+
+    def progress(self):
+        """
+        @return: (slides done, total slides), the total is 0 until the slides of the deck are known.
+        """
+        return self.status['done'], self.status['total']
+
+    def heartbeat(self):
+        """
+        Tell the worker that the session is still waiting for the job, see @param abandon_after.
+        """
+        self.status['heartbeat'] = time.time()
+
+    def cancel(self):
+        """
+        Cancel the job. A queued job is dropped, a running job stops after the slide it is working on.
+        """
+        self.status['cancelled'] = True
+        if self.future is not None:
+            self.future.cancel()
+
+    def _report(self, done, total):
+        # called by render_deck after every slide, stops the job when it is not wanted anymore
+        self.status.update(done=done, total=total)
+        if self.status['cancelled']:
+            raise JobCancelled('The render was cancelled.')
+        if self.abandon_after is not None and time.time() - self.status['heartbeat'] > self.abandon_after:
+            raise JobCancelled('The render was abandoned by its session.')
+
+    def _claim_cores(self):
+        # processes of this job: 1 for a serial render, the cores no other job renders on for a parallel one.
+        # Jobs rendering at the same time never start more processes than there are cores(beyond one per job)
+        with self.cores_lock:
+            workers = 1
+            if self.parallel:
+                idle = (os.cpu_count() or 1) - sum(self.cores.values())
+                workers = max(1, idle if self.workers is None else min(self.workers, idle))
+            self.cores[self.id] = workers
+        return workers
+
+    def _release_cores(self):
+        with self.cores_lock:
+            self.cores.pop(self.id, None)
+
+    def run(self):
+        """
+        Render the deck.
+
+        @return: (bytes of the PPT, number of slides rendered, seconds taken, stage records(see perf.Timer), cProfile report or None)
+        """
+        start = time.perf_counter()
+        output = BytesIO()
+        timer = perf.Timer()
+        profiler = cProfile.Profile() if self.profile else None
+        # profiled renders track the peak Python memory of every stage as well(peak_bytes), see perf.trace_memory
+        trace_memory = perf.trace_memory
+        if profiler is not None:
+            perf.trace_memory = True
+            profiler.enable()
+        workers = self._claim_cores()
+        try:
+            slides = pipeline.render_deck(self.dataframe, self.config, self.template, output, self.parallel and workers > 1, workers, self.streaming, self.limit, self._report, timer, self.incremental, self.reuse and not self.profile)
+        finally:
+            self._release_cores()
+            if profiler is not None:
+                profiler.disable()
+                perf.trace_memory = trace_memory
+                # the worker goes on with the next job, tracemalloc slows it down
+                if not trace_memory:
+                    tracemalloc.stop()
+        report = perf.profile_text(profiler) if profiler is not None else None
+        return output.getvalue(), slides, time.perf_counter() - start, timer.records(), report
+
+    def __getstate__(self):
+        # the future stays with the process that submitted the job
+        state = self.__dict__.copy()
+        state['future'] = None
+        return state
+
+def _run_job(job):
+    return job.run()
+
+def get_manager():
+    """
+    Server process holding the progress of the jobs, made on first use.
+
+    @return: multiprocessing.managers.SyncManager
+    """
+    global _manager
+    with _pool_lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context('spawn').Manager()
+    return _manager
+
+def get_cores():
+    """
+    Processes rendering by job id and the lock guarding it, shared by the jobs of the server through the manager.
+
+    @return: (dict proxy, lock proxy)
+    """
+    global _cores
+    manager = get_manager()
+    with _pool_lock:
+        if _cores is None:
+            _cores = (manager.dict(), manager.Lock())
+    return _cores
+
+def get_pool():
+    """
+    Process pool shared by all the sessions of the server, made on first use.
+    Workers are started with spawn, so that they do not inherit the threads of the server.
+
+    @return: ProcessPoolExecutor
+    """
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_running, mp_context=multiprocessing.get_context('spawn'))
+            _slots = threading.BoundedSemaphore(max_running + max_queued)
+    return _pool
+
+def submit(job, timeout=None):
+    """
+    Queue @param job on the shared pool. At most max_running jobs run at once, at most max_queued wait for a worker,
+    so a load spike waits in the queue instead of holding every deck in memory at the same time.
+    Jobs with reuse on whose deck is in the on disk cache are resolved at once.
+
+    @param job: RenderJob
+    @param timeout: Seconds to wait for a place in the queue, None to wait as long as it takes.
+    @return: concurrent.futures.Future resolving to the result of RenderJob.run
+    """
+    # a deck rendered before costs a hash and a file read, it never waits for a place in the queue
+    if job.reuse and not job.profile:
+        start = time.perf_counter()
+        timer = perf.Timer()
+        with timer.stage('deck_cache') as counts:
+            cached = pipeline.load_deck(pipeline.deck_key(job.dataframe, job.config, job.template, job.limit), job.template)
+            counts['hits'] = int(cached is not None)
+        if cached is not None:
+            job.future = Future()
+            job.future.set_result((cached[0], cached[1], time.perf_counter() - start, timer.records(), None))
+            return job.future
+
+    pool = get_pool()
+    if not _slots.acquire(timeout=timeout):
+        raise QueueFull('The render queue is full, please try again in a moment.')
+    # the wait for a place in the queue may be longer than abandon_after, the session has not had a chance to refresh yet
+    job.heartbeat()
+    try:
+        job.future = pool.submit(_run_job, job)
+    except Exception:
+        _slots.release()
+        raise
+    job.future.add_done_callback(lambda future: _slots.release())
+    return job.future
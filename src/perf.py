@@ -0,0 +1,115 @@
+import io
+import sys
+import json
+import time
+import pstats
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# resource is not available on Windows, the peak memory of the process is left out there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+trace_memory = False    # Track the peak Python memory of every stage with tracemalloc, slows the stages down noticeably
+
+
+def _max_rss():
+    # peak resident memory of the process so far in bytes, ru_maxrss is in kilobytes except on macOS
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+class Timer:
+    """
+    Wall time, counts and memory of the stages of a load or a render.
+    A stage entered several times(e.g. once per slide) is summed up into one entry.
+    Every stage records how much it raised the peak resident memory of the process(rss_growth_bytes), which is the
+    memory the stage needed beyond what earlier stages had already taken, and the peak of the process after it.
+    Stages should not be nested, the memory peak of the outer stage would be lost.
+    """
+
+    def __init__(self):
+        self.stages = {}    # stage name -> entry, in order of first use
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """
+        Time the body of the with statement as stage @param name.
+
+            with timer.stage('extract_rows') as counts:
+                rows = ...
+                counts['rows'] = len(rows)
+
+        @param name: Name of the stage.
+        @param counts: Counts of the stage, e.g. slides=1. More counts can be put into the yielded dict.
+        """
+        entry = self.stages.setdefault(name, {'stage': name, 'seconds': 0.0, 'calls': 0})
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        rss = _max_rss()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            entry['seconds'] += time.perf_counter() - start
+            entry['calls'] += 1
+            for key, value in counts.items():
+                entry[key] = entry.get(key, 0) + value
+            if trace_memory:
+                entry['peak_bytes'] = max(entry.get('peak_bytes', 0), tracemalloc.get_traced_memory()[1] - base)
+            if rss is not None:
+                peak = _max_rss()
+                entry['rss_growth_bytes'] = entry.get('rss_growth_bytes', 0) + peak - rss
+                # high-water mark of the whole process so far, not of this stage
+                entry['process_peak_rss_bytes'] = peak
+
+    def records(self):
+        """
+        @return: @Array of dicts, one per stage: stage, seconds, calls, counts and memory.
+        """
+        return [dict(ele, seconds=round(ele['seconds'], 4)) for ele in self.stages.values()]
+
+def stage(timer, name, **counts):
+    """
+    Timer.stage of @param timer, or a no-op when @param timer is None.
+
+    @return: Context manager yielding the dict of counts.
+    """
+    if timer is None:
+        return nullcontext(counts)
+    return timer.stage(name, **counts)
+
+def append_log(path, records, **meta):
+    """
+    Append stage records to a JSON lines file, one line per stage.
+
+    @param path: Path of the log file.
+    @param records: @Array of records, see Timer.records
+    @param meta: Fields added to every line, e.g. run='render'.
+    """
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            for ele in records:
+                f.write(json.dumps(dict(meta, time=now, **ele), default=str) + '\n')
+    except OSError:
+        # the log is a diagnostic only, failing to write it must never fail the request
+        pass
+
+def profile_text(profiler, limit=40):
+    """
+    Report of a cProfile run that can be attached to a bug report.
+
+    @param profiler: cProfile.Profile that was run.
+    @param limit: Number of functions listed.
+    @return: Functions sorted by cumulative time, as text.
+    """
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,520 @@
+import os
+import re
+import json
+import hashlib
+import zipfile
+from io import BytesIO
+
+# Pandas for dataframes
+import pandas as pd
+
+# importing all utility functions
+from src.util import *
+from src.ingest import *
+from src.render import *
+from src.writer import StreamingPptxWriter
+from src import cache, perf, predicates
+
+parallel_section_slides = 50    # In incremental mode only changed sections with more slides than this are rendered on a process pool
+
+
+def default_config():
+    """
+    Deck configuration with the defaults of the UI. The keys are named after the globals of main.py holding the same settings.
+
+    @return: dict
+    """
+    return {
+        'user_start_location': 'A1',    # Starting cell address, e.g: A13
+        'global_null_value': '-',    # This value acts as empty value in the dataframe as well as on the PPT slides
+        'openCaseCol': None,    # This column is used to segreagate opencases and closedcases
+        'global_compare_false_val': ['-'],    # Rows with one of these values in openCaseCol, or passing this rule(see src/predicates.py), are put in closed case slide.
+        'opcsheads': [],    # Headers/Column names for opencases
+        'cscsheads': [],    # Headers/Column names for closedcases
+        'openCase_rows_per_slide': 6,    # Number of rows to be displayed per slide in opencases
+        'closeCase_rows_per_slide': 6,    # Number of rows to be displayed per slide in closedcases
+        'case_groups': [],    # [[title, rule, column titles, rows per slide], ...], replaces the open/closed split: every row goes to the first group whose rule it passes
+        'ext_tab_arr': [],    # [[column titles, title of the slide, rows per slide, filter or None, sort or None, top or None], ...], see select_rows
+        'ext_cha_arr': [],    # [[column title, type of chart, name of chart, group by column or None], ...]
+        'chart_workbooks': True,    # Embed a workbook with the data of every chart, False for lightweight charts(see create_a_chart)
+        'section_by': None,    # Column the deck is split by, every section is rendered once per value of it, e.g. the source column of a multi file upload
+    }
+
+def case_split_enabled(config):
+    """
+    @param config: Deck configuration.
+    @return: True if the data is segregated into open cases and closed cases.
+    """
+    return not (config['openCaseCol'] is None or config['openCaseCol'] == '<select>')
+
+def _table_options(ele):
+    # (filter, sort, top) of an extra table and the column titles they read, older tables have none of them
+    row_filter, sort, top = (list(ele[3:6]) + [None]*3)[:3]
+    cols = ([row_filter[0]] if row_filter else []) + ([sort[0]] if sort else [])
+    return [row_filter, sort, top], cols
+
+def deck_columns(config):
+    """
+    Column titles referenced by a deck configuration.
+
+    @param config: Deck configuration.
+    @return: @Array of column titles used by the case split, the open/closed case tables, the extra tables and the charts.
+    """
+    cols = []
+    if case_split_enabled(config):
+        cols.append(config['openCaseCol'])
+    cols += list(config['opcsheads']) + list(config['cscsheads'])
+    for ele in config.get('case_groups', []):
+        cols += ele[2]
+    for ele in config['ext_tab_arr']:
+        cols += ele[0] + _table_options(ele)[1]
+    for ele in config['ext_cha_arr']:
+        cols.append(ele[0])
+        if len(ele) > 3 and ele[3] is not None:
+            cols.append(ele[3])
+    if config.get('section_by'):
+        cols.append(config['section_by'])
+    # unique, in order of first use
+    return list(dict.fromkeys(cols))
+
+def load_data(file, config, sheet=0, timer=None, workers=None):
+    """
+    Read the data region of a workbook as described by @param config, only the columns used by the deck are read.
+    Several files or sheets are read at once and put below each other, see concat_sources.
+    CSV, Parquet and Feather files are read as well, see read_region.
+
+    @param file: Path or file object of the excel, CSV, Parquet or Feather file, or @Array of them.
+    @param config: Deck configuration.
+    @param sheet: Index or name of the sheet to be read, or @Array of them(read from every file).
+    @param timer: [Optional] perf.Timer, reading is timed as the stage read_excel.
+    @param workers: Number of processes reading several sources, None for one per core.
+    @return: Pandas dataframe
+    """
+    files = file if isinstance(file, (list, tuple)) else [file]
+    sheets = sheet if isinstance(sheet, (list, tuple)) else [sheet]
+    items = [(f, s) for f in files for s in sheets]
+    cols, rows = split_start_address(config['user_start_location'])
+    with perf.stage(timer, 'read_excel', files=len(items)) as counts:
+        frames = read_concurrently(items, read_region, workers, beginx=int(rows), beginy=convert_excel_col_number(cols),
+                                   global_null_value=config['global_null_value'], usecols=deck_columns(config))
+        frames = [df.loc[:, df.columns.notna()] for df in frames]
+        df = frames[0] if len(frames) == 1 else concat_sources(frames, source_names(items), config['global_null_value'])
+        counts.update(rows=len(df), cells=df.size)
+    return df.reset_index(drop=True)
+
+def _add_missing_columns(df, headers, global_null_value='-'):
+    # IMPORTANT : if some column does not exist in the dataframe,
+    # it is created and filled with null values
+    for ele in headers:
+        if ele not in df.columns:
+            df[ele] = global_null_value
+
+def extract_case_rows(df, config):
+    """
+    Segregate the data into open cases and closed cases.
+    Missing columns are added to @param df, filled with the null value.
+
+    @param df: dataframe
+    @param config: Deck configuration.
+    @return: opencases, closedcases as [column titles, rows]
+    """
+    opcsheads, cscsheads = list(config['opcsheads']), list(config['cscsheads'])
+    global_null_value = config['global_null_value']
+    _add_missing_columns(df, opcsheads + cscsheads, global_null_value)
+
+    # a single boolean mask segregates the data, True for closed cases
+    closed_mask = predicates.compile_rule(config['global_compare_false_val'], global_null_value)(df[config['openCaseCol']])
+
+    # first entry of every table are the column titles, these titles make up the topmost row displayed in every slide.
+    opencases = [opcsheads, extract_columns(df, opcsheads, global_null_value, ~closed_mask)]
+    closedcases = [cscsheads, extract_columns(df, cscsheads, global_null_value, closed_mask)]
+    return opencases, closedcases
+
+def extract_table_rows(df, headers, global_null_value='-'):
+    """
+    Extract the columns @param headers of @param df as a table.
+    Missing columns are added to @param df, filled with the null value.
+
+    @param df: dataframe
+    @param headers: Column titles of the table.
+    @param global_null_value: Null values are replaced by this value.
+    @return: [column titles, rows], or [[], []] for invalid headers
+    """
+    if len(headers) == 0:
+        return [[], []]
+    _add_missing_columns(df, headers, global_null_value)
+    return [list(headers), extract_columns(df, headers, global_null_value)]
+
+def section_values(df, config):
+    """
+    Values of the section_by column of a deck configuration, in order of first appearance.
+
+    @param df: dataframe
+    @param config: Deck configuration.
+    @return: @Array of values, None when the deck is not split.
+    """
+    col = config.get('section_by')
+    if not col or col not in df.columns:
+        return None
+    return list(pd.unique(df[col]))
+
+def select_rows(df, row_filter=None, sort=None, top=None, global_null_value='-'):
+    """
+    Rows of an extra table: filtered by a rule, sorted and cut down to the first @param top rows, before any row is extracted.
+    Only the rows that are kept ever reach the slides.
+
+    @param df: dataframe
+    @param row_filter: [Optional] [column title, rule], only the rows passing the rule(see src/predicates.py) are kept.
+    @param sort: [Optional] [column title, descending]. Numbers are sorted by value with the rows without a number last,
+            columns without any number are sorted as text.
+    @param top: [Optional] Number of rows kept, e.g. 10 for the top 10 by @param sort.
+    @param global_null_value: Value that counts as empty.
+    @return: Pandas dataframe
+    """
+    if row_filter and row_filter[0] in df.columns:
+        df = df[predicates.compile_rule(row_filter[1], global_null_value)(df[row_filter[0]]).to_numpy()]
+
+    if sort and sort[0] in df.columns:
+        col, descending = sort
+        numbers = predicates.column_numbers(df[col])
+        if numbers.notna().any():
+            if top:
+                # only the top rows are ordered, the rows without a number fill up what is left.
+                # nlargest/nsmallest keep the nan rows when @param top covers every row, they are appended once below
+                valid = numbers.dropna()
+                best = valid.nlargest(top) if descending else valid.nsmallest(top)
+                order = best.index.append(numbers.index[numbers.isna()][:top-len(best)])
+            else:
+                order = numbers.sort_values(ascending=not descending, kind='stable', na_position='last').index
+        else:
+            order = df[col].astype(object).sort_values(ascending=not descending, kind='stable', na_position='last').index
+            if top:
+                order = order[:top]
+        df = df.loc[order]
+    elif top:
+        df = df.iloc[:top]
+    return df.reset_index(drop=True)
+
+def deck_sections(config, limit=-1, values=None):
+    """
+    Sections of a deck in slide order: every chart, the open cases and the closed cases(or every case group) and every extra table.
+    A section is rendered as a whole, its slides only depend on its spec and on the data of its columns.
+
+    @param config: Deck configuration.
+    @param limit: Dev mode only, maximum number of rows per table.
+    @param values: [Optional] Values of the section_by column(see section_values), all the sections are repeated for every value.
+    @return: @Array of dicts: kind(chart, open, closed, group or table), spec(settings of the section), columns(column titles it reads)
+            and source([column, value] the rows of the section are selected by, or None)
+    """
+    global_null_value = config['global_null_value']
+    sections = []
+    for ele in config['ext_cha_arr']:
+        group_col = ele[3] if len(ele) > 3 else None
+        cols = [ele[0]] if group_col is None else [ele[0], group_col]
+        sections.append({'kind': 'chart', 'spec': [ele[0], ele[1], ele[2], group_col, global_null_value, config.get('chart_workbooks', True)], 'columns': cols})
+
+    if case_split_enabled(config) and config.get('case_groups'):
+        # rows go to the first group they pass, so the rules of the earlier groups are part of the spec of a group
+        rules = [ele[1] for ele in config['case_groups']]
+        for i, ele in enumerate(config['case_groups']):
+            sections.append({'kind': 'group', 'spec': [config['openCaseCol'], rules[:i+1], ele[0], list(ele[2]), ele[3], global_null_value, limit],
+                             'columns': [config['openCaseCol']] + list(ele[2])})
+    elif case_split_enabled(config):
+        rule = config['global_compare_false_val']
+        split = [config['openCaseCol'], rule if isinstance(rule, str) else list(rule)]
+        sections.append({'kind': 'open', 'spec': split + [list(config['opcsheads']), config['openCase_rows_per_slide'], global_null_value, limit],
+                         'columns': [config['openCaseCol']] + list(config['opcsheads'])})
+        sections.append({'kind': 'closed', 'spec': split + [list(config['cscsheads']), config['closeCase_rows_per_slide'], global_null_value, limit],
+                         'columns': [config['openCaseCol']] + list(config['cscsheads'])})
+
+    for ele in config['ext_tab_arr']:
+        options, cols = _table_options(ele)
+        sections.append({'kind': 'table', 'spec': [list(ele[0]), ele[1], ele[2], global_null_value, limit] + options, 'columns': list(ele[0]) + cols})
+
+    if values is None:
+        return [dict(section, source=None) for section in sections]
+    # one deck section per value, e.g. all the slides of a region and then all the slides of the next one
+    col = config['section_by']
+    return [dict(section, source=[col, value], columns=[col] + section['columns']) for value in values for section in sections]
+
+def section_tasks(df, section, timer=None, memo=None):
+    """
+    Slide tasks of one section of a deck.
+
+    @param df: dataframe
+    @param section: Section made by deck_sections.
+    @param timer: [Optional] perf.Timer, chart data and table rows are timed as the stages aggregate_charts and extract_rows.
+    @param memo: [Optional] Frequency tables shared by the sections of one render, see category_counts.
+    @return: @Array of slide tasks, see src/render.py
+    """
+    kind, spec = section['kind'], section['spec']
+    # sections of a split deck only show their own rows, their titles are marked with the value
+    suffix = ''
+    scope = None
+    if section.get('source') is not None:
+        col, value = section['source']
+        df = df[(df[col] == value).to_numpy()].reset_index(drop=True)
+        suffix = ' - %s' % value
+        scope = (col, value)
+
+    if kind == 'chart':
+        data_col, chart_type, title, group_col, global_null_value, workbook = spec
+        chart_type = chart_type.lower()
+        title += suffix
+        # get the data to be displayed onto the chart, charts on the same column share one frequency table
+        with perf.stage(timer, 'aggregate_charts', charts=1, rows=len(df)):
+            if chart_type in ('stacked bar', 'clustered bar'):
+                data = category_counts(df, data_col, global_null_value, True, group_col=group_col, memo=memo, scope=scope)
+            else:
+                data = category_counts(df, data_col, global_null_value, True, memo=memo, scope=scope)
+        if chart_type == 'pie':
+            return [chart_task(data, [2.5,1,8,6], chart_type, title, workbook)]
+        elif chart_type == 'bar':
+            return [chart_task(data, [0.5,0.6,12,6.5], chart_type, title, workbook)]
+        elif chart_type == 'donut':
+            return [chart_task(data, [0.5,0.6,12,6.5], chart_type, title, workbook)]
+        elif chart_type in ('stacked bar', 'clustered bar'):
+            return [chart_task(data, [0.5,0.6,12,6.5], chart_type.split()[0], title, workbook)]
+        return []
+
+    if kind in ('open', 'closed'):
+        split_col, rule, headers, sz, global_null_value, limit = spec
+        # sections without columns have no slides
+        if len(headers) == 0:
+            return []
+        with perf.stage(timer, 'extract_rows') as counts:
+            _add_missing_columns(df, headers, global_null_value)
+            # True for closed cases
+            mask = predicates.compile_rule(rule, global_null_value)(df[split_col])
+            rows = extract_columns(df, headers, global_null_value, mask if kind == 'closed' else ~mask)
+            counts['cells'] = rows.size
+        return table_tasks([list(headers), rows], sz, ('Open Cases' if kind == 'open' else 'Closed Cases') + suffix, global_null_value, limit)
+
+    if kind == 'group':
+        split_col, rules, title, headers, sz, global_null_value, limit = spec
+        if len(headers) == 0:
+            return []
+        with perf.stage(timer, 'extract_rows') as counts:
+            _add_missing_columns(df, headers, global_null_value)
+            # rows of this group: the last rule is the first one they pass
+            mask = predicates.assign_groups(df[split_col], rules, global_null_value) == len(rules)-1
+            rows = extract_columns(df, headers, global_null_value, mask)
+            counts['cells'] = rows.size
+        return table_tasks([list(headers), rows], sz, title + suffix, global_null_value, limit)
+
+    headers, title, sz, global_null_value, limit, row_filter, sort, top = spec
+    if row_filter or sort or top:
+        with perf.stage(timer, 'select_rows') as counts:
+            df = select_rows(df, row_filter, sort, top, global_null_value)
+            counts['rows'] = len(df)
+    with perf.stage(timer, 'extract_rows') as counts:
+        data = extract_table_rows(df, headers, global_null_value)
+        counts['cells'] = len(data[1])*len(data[0])
+    return table_tasks(data, sz, title + suffix, global_null_value, limit)
+
+def build_tasks(df, config, limit=-1, timer=None):
+    """
+    Slide tasks of a deck: charts first, then open cases and closed cases(or the case groups) and the extra tables.
+    A deck split by the section_by column repeats them for every value of the column.
+
+    @param df: dataframe
+    @param config: Deck configuration.
+    @param limit: Dev mode only, maximum number of rows per table.
+    @param timer: [Optional] perf.Timer, chart data and table rows are timed as the stages aggregate_charts and extract_rows.
+    @return: @Array of slide tasks, see src/render.py
+    """
+    tasks = []
+    # frequency tables of this render only
+    memo = {}
+    for section in deck_sections(config, limit, section_values(df, config)):
+        tasks += section_tasks(df, section, timer, memo)
+    return tasks
+
+def append_end_slide(prs):
+    """
+    Append the end slide to the PPT
+
+    @param prs: PPT Presentation object
+    """
+    layout = prs.slide_layouts[5]
+    slide=prs.slides.add_slide(layout)
+    # slide.shapes.add_picture('data/end.png', 0, 0, prs.slide_width, prs.slide_height)
+
+def _render_slides(prs, template, tasks, parallel, workers, writer, on_progress, timer):
+    # render the slides, in parallel mode the tasks are sharded over a process pool and merged back in order
+    if parallel:
+        # tables and charts are rendered by the workers, only the whole render is timed
+        with perf.stage(timer, 'render_parallel', slides=len(tasks)):
+            render_parallel(prs, template, tasks, workers, writer, on_progress)
+    else:
+        render_tasks(prs, tasks, writer, on_progress, timer)
+
+def _count_slides(pptx):
+    # number of slides of a saved pptx, counted in presentation.xml without parsing the slides
+    with zipfile.ZipFile(BytesIO(pptx)) as z:
+        return len(re.findall(rb'<(?:\w+:)?sldId\b', z.read('ppt/presentation.xml')))
+
+def _plan_sections(df, config, template, limit=-1, timer=None):
+    """
+    Look up the sections of a deck in the cache, the slide tasks of the sections that are not cached are built.
+    A section is cached under its spec, the number of rows, the fingerprints of the columns it reads and the hash of the template.
+
+    @return: @Array of (cache key, cached pptx bytes or None, slide tasks or None)
+    """
+    sections = deck_sections(config, limit, section_values(df, config))
+    # fingerprints are taken before any section adds missing columns to @param df
+    with perf.stage(timer, 'fingerprint') as counts:
+        columns = list(dict.fromkeys(col for section in sections for col in section['columns']))
+        digests = {col: cache.column_digest(df[col]) if col in df.columns else None for col in columns}
+        counts['columns'] = len(columns)
+    template_key = hashlib.sha256(template).hexdigest()
+
+    plan = []
+    memo = {}
+    for section in sections:
+        # the row count tells apart tables whose columns are all missing(blank columns), like in deck_key
+        key = cache.make_key('section', section['kind'], repr(section['spec']), repr(section['source']), len(df), template_key, *[digests[col] for col in section['columns']])
+        blob = cache.load_blob(key, '.pptx')
+        plan.append((key, blob, None if blob is not None else section_tasks(df, section, timer, memo)))
+    return plan
+
+def deck_key(df, config, template, limit=-1):
+    """
+    Content key of a finished deck, made of everything the deck depends on: the data of the columns it reads,
+    the template and the settings. Settings left out of @param config count as their defaults.
+
+    @param df: dataframe
+    @param config: Deck configuration.
+    @param template: Bytes of the template pptx file.
+    @param limit: Dev mode only, maximum number of rows per table.
+    @return: Cache key of the deck.
+    """
+    # the start cell only matters for loading, the data it selects is part of the key anyway
+    settings = {key: config.get(key, value) for key, value in default_config().items() if key != 'user_start_location'}
+    columns = deck_columns(config)
+    digests = [cache.column_digest(df[col]) if col in df.columns else None for col in columns]
+    return cache.make_key('deck', json.dumps(settings, sort_keys=True, default=str), limit, len(df), hashlib.sha256(template).hexdigest(), *columns, *digests)
+
+def load_deck(key, template):
+    """
+    Finished deck from the on disk cache, see deck_key.
+
+    @param key: Cache key of the deck.
+    @param template: Bytes of the template pptx file.
+    @return: (bytes of the PPT, number of slides rendered), or None on a miss.
+    """
+    blob = cache.load_blob(key, '.pptx')
+    if blob is None:
+        return None
+    return blob, _count_slides(blob) - _count_slides(template)
+
+def _output_bytes(output):
+    # bytes of a saved deck, None when they can not be read back from @param output
+    if hasattr(output, 'getvalue'):
+        return output.getvalue()
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'rb') as f:
+            return f.read()
+    return None
+
+def render_deck(df, config, template, output, parallel=False, workers=None, streaming=False, limit=-1, progress=None, timer=None, incremental=False, reuse=False):
+    """
+    Render a whole deck and save it.
+
+    @param df: dataframe
+    @param config: Deck configuration.
+    @param template: Bytes of the template pptx file.
+    @param output: Path or file object the PPT is saved to.
+    @param parallel: Render the slides on a process pool, see render_parallel.
+    @param workers: Number of processes used when @param parallel is True, None for one per core.
+    @param streaming: Write slides to @param output as they are rendered, see StreamingPptxWriter.
+    @param limit: Dev mode only, maximum number of rows per table.
+    @param progress: [Optional] Called with (slides done, total slides) while rendering. It may raise to stop rendering.
+    @param timer: [Optional] perf.Timer the stages of the render are recorded in.
+    @param incremental: Reuse the slides of sections rendered earlier with the same settings, data and template, see _plan_sections.
+            Only the sections that changed are rendered, every section is kept in the on disk cache.
+            Ignored with @param streaming, changed sections would be rendered into whole presentations in memory.
+    @param reuse: Serve a deck rendered earlier from the same data, template and settings(see deck_key) from the on disk cache,
+            finished decks are kept there.
+    @return: Number of slides rendered(without the slides of the template).
+    """
+    if reuse:
+        # the key is taken before any section adds missing columns to @param df
+        with perf.stage(timer, 'deck_cache') as counts:
+            key = deck_key(df, config, template, limit)
+            cached = load_deck(key, template)
+            counts['hits'] = int(cached is not None)
+        if cached is not None:
+            if hasattr(output, 'write'):
+                output.write(cached[0])
+            else:
+                with open(output, 'wb') as f:
+                    f.write(cached[0])
+            if progress is not None:
+                progress(cached[1], cached[1])
+            return cached[1]
+
+    # low memory mode wins, a changed section would be rendered and parsed again as a whole presentation
+    incremental = incremental and not streaming
+    if incremental:
+        plan = _plan_sections(df, config, template, limit, timer)
+        template_slides = _count_slides(template)
+        sizes = [len(tasks) if blob is None else _count_slides(blob) - template_slides for key, blob, tasks in plan]
+    else:
+        tasks = build_tasks(df, config, limit, timer)
+        sizes = [len(tasks)]
+
+    # slides done so far, reported through @param progress
+    total = sum(sizes) + 1
+    done = [0]
+    on_progress = None
+    if progress is not None:
+        def on_progress(n):
+            done[0] += n
+            progress(done[0], total)
+        progress(0, total)
+
+    # in streaming mode every slide is written to the output file as soon as it is rendered, and then released
+    writer = None
+    if streaming:
+        writer = StreamingPptxWriter(template, output)
+        prs = writer.prs
+    else:
+        prs = cache.load_template(template)
+
+    # in incremental mode the deck is put together section by section, cached sections are only merged
+    if incremental:
+        for (section_key, blob, section), size in zip(plan, sizes):
+            if blob is None:
+                # changed section: rendered into its own copy of the template and cached,
+                # small sections are not worth starting a process pool for
+                sub = cache.load_template(template)
+                _render_slides(sub, template, section, parallel and size > parallel_section_slides, workers, None, on_progress, timer)
+                out = BytesIO()
+                sub.save(out)
+                blob = out.getvalue()
+                cache.store_blob(section_key, blob, '.pptx')
+            elif on_progress is not None:
+                on_progress(size)
+            with perf.stage(timer, 'merge_sections', slides=size):
+                merge_slides(prs, Presentation(BytesIO(blob)), template_slides)
+            if writer is not None:
+                writer.flush()
+    else:
+        _render_slides(prs, template, tasks, parallel, workers, writer, on_progress, timer)
+
+    append_end_slide(prs)
+
+    # Save the PPT
+    with perf.stage(timer, 'save', slides=len(prs.slides)):
+        if writer is not None:
+            writer.close()
+        else:
+            prs.save(output)
+    if on_progress is not None:
+        on_progress(1)
+    if reuse:
+        blob = _output_bytes(output)
+        if blob is not None:
+            cache.store_blob(key, blob, '.pptx')
+    return total
@@ -0,0 +1,195 @@
+import re
+import operator
+
+# Pandas for dataframes
+import pandas as pd
+import numpy as np
+
+# Rules select rows by the value of one column, they are compiled once and tested on the whole column at once.
+#
+#     -,NO,_            equals one of these values(the values are taken as they are, spaces included)
+#     "Rock and Roll"   equals this value, quotes keep and/or/commas in the value
+#     > 30   <= 7.5     numeric threshold, also >=, <, and = or != for numbers and texts
+#     30..90   ..7      numeric range, both ends included, an end may be left out
+#     ~ ^ESC-\d+        regular expression, found anywhere in the value
+#     empty             null value(or an empty cell), "non-empty" for the others
+#     not <rule>        the opposite of a rule
+#     > 30 and < 90     clauses joined by "and" and "or", "and" binds first
+#
+# Values that are not numbers never pass a numeric clause, missing values never pass a comparison.
+# A rule without any operator is a plain list of values as a whole, "and" and "or" included(e.g. Rock and Roll).
+# Values that start like an operator(e.g. =N/A, ~, empty) have to be quoted: "=N/A"
+
+_comparisons = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '=': operator.eq, '==': operator.eq, '!=': operator.ne}
+_comparison_re = re.compile(r'^(>=|<=|!=|==|=|>|<)\s*(.*)$', re.S)
+_range_re = re.compile(r'^(-?\d+(?:\.\d+)?)?\s*\.\.\s*(-?\d+(?:\.\d+)?)?$')
+# joins outside of quotes, quoted values are matched as a whole so that they are skipped
+_join_re = re.compile(r'"[^"]*"|\s+(and|or)\s+', re.I)
+
+
+class _Column:
+    # column a rule is tested on, its numeric values are parsed once for all the clauses of the rule
+
+    def __init__(self, column, global_null_value):
+        self.column = column
+        self.global_null_value = global_null_value
+        self._numbers = None
+
+    @property
+    def numbers(self):
+        if self._numbers is None:
+            # every distinct value is parsed once, columns usually hold few of them(e.g. days open)
+            codes, uniques = pd.factorize(self.column)
+            numbers = pd.to_numeric(pd.Series(np.asarray(uniques, dtype=object)), errors='coerce').to_numpy(dtype=float)
+            # missing values have the code -1, which picks the nan appended last
+            self._numbers = pd.Series(np.append(numbers, np.nan)[codes], index=self.column.index)
+        return self._numbers
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return text[1:-1]
+    return None
+
+def _split_rule(rule):
+    # [clause, join, clause, join, ...], like re.split but quotes are kept together
+    parts, start = [], 0
+    for match in _join_re.finditer(rule):
+        if match.group(1):
+            parts += [rule[start:match.start()], match.group(1).lower()]
+            start = match.end()
+    return parts + [rule[start:]]
+
+def _plain(text):
+    # True if the clause has no operator, i.e. it is a list of values
+    clause = text.strip()
+    lower = clause.lower()
+    if lower.startswith('not ') or lower in ('empty', 'non-empty') or clause.startswith('~') or _unquote(clause) is not None:
+        return False
+    match = _range_re.match(clause)
+    return not (match and (match.group(1) or match.group(2))) and not _comparison_re.match(clause)
+
+def _compile_clause(text, raw=False):
+    """
+    Compile a single clause of a rule.
+
+    @param text: Clause, e.g. > 30
+    @param raw: The clause is the whole rule, a plain list of values is then taken without stripping spaces(like the UI always did).
+    @return: function(_Column) returning a boolean pandas series.
+    """
+    test = _compile_test(text, raw)
+    # nullable(e.g. Arrow backed) columns compare to NA on missing values, those rows do not pass
+    return lambda col: test(col).fillna(False).astype(bool)
+
+def _compile_test(text, raw):
+    clause = text.strip()
+    if clause.lower().startswith('not '):
+        test = _compile_clause(clause[4:])
+        return lambda col: ~test(col)
+
+    quoted = _unquote(clause)
+    if quoted is not None:
+        return lambda col: col.column == quoted
+
+    if clause.lower() in ('empty', 'non-empty'):
+        def empty(col):
+            values = col.column
+            return values.isna() | values.isin([col.global_null_value, ''])
+        if clause.lower() == 'empty':
+            return empty
+        return lambda col: ~empty(col)
+
+    if clause.startswith('~'):
+        try:
+            pattern = re.compile(clause[1:].strip())
+        except re.error as e:
+            raise ValueError("invalid regular expression '%s': %s" % (clause[1:].strip(), e))
+        return lambda col: col.column.astype(object).str.contains(pattern, na=False).astype(bool)
+
+    match = _range_re.match(clause)
+    if match and (match.group(1) or match.group(2)):
+        low = float(match.group(1)) if match.group(1) else -np.inf
+        high = float(match.group(2)) if match.group(2) else np.inf
+        return lambda col: col.numbers.between(low, high)
+
+    match = _comparison_re.match(clause)
+    if match:
+        op, value = _comparisons[match.group(1)], match.group(2).strip()
+        number = _number(value)
+        if number is not None:
+            return lambda col: op(col.numbers, number) & col.numbers.notna()
+        if match.group(1) not in ('=', '==', '!='):
+            raise ValueError("'%s' needs a number, got '%s'" % (match.group(1), value))
+        value = _unquote(value) if _unquote(value) is not None else value
+        return lambda col: op(col.column, value) & col.column.notna()
+
+    # a plain list of values
+    values = (text if raw else clause).split(',')
+    return lambda col: col.column.isin(values)
+
+def compile_rule(rule, global_null_value='-'):
+    """
+    Compile a rule(see the top of this module) into a test of a whole column.
+
+    @param rule: Rule as text, or @Array of values(the row passes if it equals one of them).
+    @param global_null_value: Value that counts as empty.
+    @return: function(column) returning a boolean pandas series, True for the rows that pass.
+    """
+    test = _compile_rule(rule)
+    return lambda column: test(_Column(column, global_null_value))
+
+def _compile_rule(rule):
+    # compile_rule on a _Column, so that several rules can share its parsed numbers
+    if not isinstance(rule, str):
+        values = list(rule)
+        return lambda col: col.column.isin(values)
+
+    # "and" binds first: a or b and c = a or (b and c)
+    parts = _split_rule(rule)
+    # without any operator "and" and "or" are part of the values, like before rules existed
+    raw = all(_plain(clause) for clause in parts[::2])
+    if raw:
+        parts = [rule]
+    groups = [[_compile_clause(parts[0], raw)]]
+    for join, clause in zip(parts[1::2], parts[2::2]):
+        if join == 'or':
+            groups.append([])
+        groups[-1].append(_compile_clause(clause))
+
+    def test(col):
+        result = None
+        for group in groups:
+            passed = group[0](col)
+            for clause in group[1:]:
+                passed = passed & clause(col)
+            result = passed if result is None else result | passed
+        return result
+    return test
+
+def assign_groups(column, rules, global_null_value='-'):
+    """
+    Put every row into the first group whose rule it passes, e.g. aging bands: > 90, > 30, > 0.
+
+    @param column: Pandas series the rules are tested on.
+    @param rules: @Array of rules, one per group.
+    @param global_null_value: Value that counts as empty.
+    @return: Numpy array of group positions, one per row, -1 for the rows that pass no rule.
+    """
+    if len(rules) == 0:
+        return np.full(len(column), -1)
+    col = _Column(column, global_null_value)
+    return np.select([_compile_rule(rule)(col).to_numpy(dtype=bool) for rule in rules], list(range(len(rules))), -1)
+
+def column_numbers(column):
+    """
+    Numeric values of a column of strings, parsed once per distinct value.
+
+    @param column: Pandas series.
+    @return: Pandas series of floats, nan for the values that are not numbers.
+    """
+    return _Column(column, None).numbers
@@ -0,0 +1,229 @@
+import os
+import re
+from copy import deepcopy
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+# for pptx
+from pptx import Presentation
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.packuri import PackURI
+from pptx.parts.slide import SlidePart
+from pptx.oxml.ns import qn
+
+# importing all utility functions
+from src.util import *
+from src import cache, perf
+
+streaming_shard_size = 50    # Slides per shard of render_parallel when the deck is streamed to a StreamingPptxWriter
+
+# relationship attributes that have to be re-linked when a slide is copied into another presentation
+_rel_attrs = [qn('r:id'), qn('r:embed'), qn('r:link'), qn('r:pict')]
+
+
+def table_tasks(data, sz=6, title='', global_null_value='-', limit=-1):
+    """
+    Break a table into slide tasks, one per slide.
+
+    @param data: [column titles, rows] as returned by extract_rows.
+    @param sz: number of rows to be displayed per slide.
+    @param title: Title of the first slide, the following ones are marked as continued.
+    @param global_null_value: Value shown for nan entries.
+    @param limit: Dev mode only, maximum number of rows(including the column titles).
+    @return: @Array of ('table', column titles, rows of the slide, title, global_null_value)
+    """
+    tasks = []
+    # empty tables have no slides
+    if len(data) == 0:
+        return tasks
+    headers, rows = data
+    n = len(rows)
+
+    # dev mode only
+    if limit != -1:
+        n = min(limit-1, n)
+
+    # break data into chunks of size @param sz per slide, each chunk is a view of the rows
+    for i in range(0, n, sz):
+        naming = title
+        if i > 0:
+            naming += ' Continued...'
+        tasks.append(('table', headers, rows[i:min(i+sz, n)], naming, global_null_value))
+    return tasks
+
+def chart_task(data, position, typeOfChart, nameofchart='', workbook=True):
+    """
+    Slide task of a chart, see create_a_chart for the parameters.
+
+    @return: ('chart', data, position, typeOfChart, nameofchart, workbook)
+    """
+    return ('chart', data, position, typeOfChart, nameofchart, workbook)
+
+def render_tasks(prs, tasks, writer=None, on_progress=None, timer=None):
+    """
+    Render slide tasks one after another into @param prs.
+
+    @param prs: PPT Presentation object
+    @param tasks: @Array of tasks made by table_tasks and chart_task.
+    @param writer: [Optional] StreamingPptxWriter of @param prs, every slide is flushed to it as soon as it is rendered.
+    @param on_progress: [Optional] Called with the number of slides finished, after every slide. It may raise to stop rendering.
+    @param timer: [Optional] perf.Timer, table and chart slides are timed as the stages render_tables and render_charts.
+    """
+    for task in tasks:
+        if task[0] == 'table':
+            kind, headers, rows, title, global_null_value = task
+            with perf.stage(timer, 'render_tables', slides=1, cells=len(rows)*len(headers)):
+                create_a_slide_with_data(prs, rows, titleofslide=title, global_null_value=global_null_value, headers=headers)
+        elif task[0] == 'chart':
+            kind, data, position, typeOfChart, nameofchart, workbook = task
+            with perf.stage(timer, 'render_charts', slides=1):
+                create_a_chart(prs, data, position, None, typeOfChart=typeOfChart, nameofchart=nameofchart, workbook=workbook)
+        if writer is not None:
+            writer.flush()
+        if on_progress is not None:
+            on_progress(1)
+
+def _render_shard(template, tasks):
+    """
+    Worker side of render_parallel, renders @param tasks into a fresh copy of the template.
+
+    @param template: Bytes of the template pptx file.
+    @param tasks: @Array of slide tasks.
+    @return: (number of slides of the template, bytes of the rendered pptx)
+    """
+    prs = cache.load_template(template)
+    start = len(prs.slides)
+    render_tasks(prs, tasks)
+    out = BytesIO()
+    prs.save(out)
+    return start, out.getvalue()
+
+def _adopt_part(package, part, adopted):
+    """
+    Give @param part and the parts it refers to new names that are free in @param package,
+    so that they can be related to a part of @param package. Each part is renamed only once.
+
+    @param package: Package the part is moved into.
+    @param part: Part of another package.
+    @param adopted: Set of ids of the parts already renamed.
+    """
+    if id(part) in adopted:
+        return
+    adopted.add(id(part))
+    # e.g. /ppt/charts/chart3.xml -> /ppt/charts/chart%d.xml
+    tmpl = re.sub(r'\d+(\.\w+)$', r'%d\1', str(part.partname))
+    if '%d' in tmpl:
+        part.partname = PackURI(str(package.next_partname(tmpl)))
+    for rId, rel in list(part.rels.items()):
+        if not rel.is_external:
+            _adopt_part(package, rel.target_part, adopted)
+
+def merge_slides(prs, src, start=0):
+    """
+    Append the slides of @param src, starting at @param start, to @param prs.
+    Shapes are copied as they are, charts, images and other related parts are moved over and re-linked.
+    Both presentations must be made from the same template.
+
+    @param prs: PPT Presentation object the slides are appended to.
+    @param src: PPT Presentation object holding the rendered slides.
+    @param start: Index of the first slide of @param src to be copied.
+    """
+    package = prs.part.package
+    layouts = list(src.slide_layouts)
+    adopted = set()
+
+    # slide ids, part names and rIds of the new slides are counted up here, add_slide looks for free ones
+    # among all the slides of @param prs for every slide, which makes merging big decks quadratic
+    sldIdLst = prs.slides._sldIdLst
+    next_id = max([255] + [int(ele) for ele in sldIdLst.xpath('./p:sldId/@id')]) + 1
+    next_number = max([0] + [int(re.search(r'(\d+)\.xml$', str(ele.part.partname)).group(1)) for ele in prs.slides]) + 1
+    add_relationship = getattr(prs.part.rels, '_add_relationship', None)
+
+    for src_slide in list(src.slides)[start:]:
+        layout = prs.slide_layouts[layouts.index(src_slide.slide_layout)]
+        if add_relationship is None:
+            # older python-pptx
+            slide = prs.slides.add_slide(layout)
+        else:
+            part = SlidePart.new(PackURI('/ppt/slides/slide%d.xml' % next_number), package, layout.part)
+            sldIdLst._add_sldId(id=next_id, rId=add_relationship(RT.SLIDE, part))
+            slide = part.slide
+            next_number += 1
+            next_id += 1
+
+        # parts related to the slide(except the layout) are moved over, rIds are mapped to the new ones
+        rIds = {}
+        for rId, rel in list(src_slide.part.rels.items()):
+            if rel.reltype in (RT.SLIDE_LAYOUT, RT.NOTES_SLIDE):
+                continue
+            if rel.is_external:
+                rIds[rId] = slide.part.relate_to(rel.target_ref, rel.reltype, is_external=True)
+                continue
+            _adopt_part(package, rel.target_part, adopted)
+            rIds[rId] = slide.part.relate_to(rel.target_part, rel.reltype)
+
+        # the placeholders added by add_slide are replaced by the rendered shapes
+        spTree = slide.shapes._spTree
+        for ele in list(spTree)[2:]:
+            spTree.remove(ele)
+        for ele in list(src_slide.shapes._spTree)[2:]:
+            ele = deepcopy(ele)
+            # slides without related parts(e.g. tables) have nothing to re-link
+            if rIds:
+                for node in ele.iter():
+                    for attr in _rel_attrs:
+                        if node.get(attr) in rIds:
+                            node.set(attr, rIds[node.get(attr)])
+            spTree.append(ele)
+
+def render_parallel(prs, template, tasks, workers=None, writer=None, on_progress=None):
+    """
+    Render slide tasks on a process pool and merge the slides into @param prs in their original order.
+    The tasks are split into one contiguous shard per worker, every worker renders its shard into a copy of the template.
+
+    @param prs: PPT Presentation object made from @param template.
+    @param template: Bytes of the template pptx file.
+    @param tasks: @Array of slide tasks.
+    @param workers: Number of worker processes, defaults to the number of cores.
+    @param writer: [Optional] StreamingPptxWriter of @param prs, shards are kept small and flushed to it as soon as they are merged.
+    @param on_progress: [Optional] Called with the number of slides finished, after every merged shard. It may raise to stop rendering.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+    if workers <= 1:
+        render_tasks(prs, tasks, writer, on_progress)
+        return
+
+    # contiguous shards keep the order of the slides, they are kept small when the progress is followed
+    step = -(-len(tasks)//workers)
+    if writer is not None or on_progress is not None:
+        step = min(step, streaming_shard_size)
+    shards = [tasks[i:i+step] for i in range(0, len(tasks), step)]
+    with ProcessPoolExecutor(workers) as pool:
+        try:
+            for shard, (start, blob) in zip(shards, pool.map(_render_shard, [template]*len(shards), shards)):
+                merge_slides(prs, Presentation(BytesIO(blob)), start)
+                if writer is not None:
+                    writer.flush()
+                if on_progress is not None:
+                    on_progress(len(shard))
+        except BaseException:
+            # shards that did not start yet are dropped
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+def template_bytes(template_file):
+    """
+    Bytes of a template given as a path or an uploaded file.
+
+    @param template_file: Path or file object(e.g. Streamlit UploadedFile) of the pptx template.
+    @return: Bytes of the template.
+    """
+    if hasattr(template_file, 'getvalue'):
+        return template_file.getvalue()
+    if hasattr(template_file, 'read'):
+        template_file.seek(0)
+        return template_file.read()
+    with open(template_file, 'rb') as f:
+        return f.read()
@@ -0,0 +1,165 @@
+import time
+import threading
+
+memory_budget = 2*1024**3    # Bytes of session data kept by the server, unused frames and then the least recently active sessions are evicted beyond this
+idle_seconds = 30*60    # Sessions inactive for longer than this are evicted even when the budget is not reached
+
+# Frames by content key, shared by every session that loaded the same data:
+# key -> {'value': frame, 'bytes': size, 'refs': set of (session, name) holding it, 'seen': last use}
+_frames = {}
+# session key -> {'seen': last activity, 'values': {name: frame key}}
+_sessions = {}
+_lock = threading.Lock()
+
+
+def size_of(value):
+    """
+    Memory taken by a value kept for a session.
+
+    @param value: Pandas dataframe, or anything else(counted as 0 bytes).
+    @return: Size in bytes.
+    """
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+def _view(value):
+    # copy on write: every caller gets its own shallow copy, columns added to it never reach the shared frame
+    if hasattr(value, 'copy'):
+        return value.copy(deep=False)
+    return value
+
+def touch(session):
+    """
+    Mark @param session as active and evict the data of idle sessions.
+
+    @param session: Key of the session, e.g. a random token kept in its session_state.
+    """
+    with _lock:
+        if session in _sessions:
+            _sessions[session]['seen'] = time.time()
+        _evict()
+
+def get(session, name):
+    """
+    Value kept for a session.
+
+    @param session: Key of the session.
+    @param name: Name of the value, e.g. dataframe.
+    @return: The value(a shallow copy of it), or None if it was never stored or was evicted since.
+    """
+    with _lock:
+        entry = _sessions.get(session)
+        if entry is None or name not in entry['values']:
+            return None
+        entry['seen'] = time.time()
+        frame = _frames[entry['values'][name]]
+        frame['seen'] = entry['seen']
+        return _view(frame['value'])
+
+def attach(session, name, key):
+    """
+    Hold the frame stored under @param key by any session as the value @param name of @param session.
+    This is how sessions that loaded the same data share one frame.
+
+    @param session: Key of the session.
+    @param name: Name of the value, e.g. dataframe.
+    @param key: Content key of the frame, e.g. hash of the upload and the start cell.
+    @return: The value(a shallow copy of it), or None if no session holds a frame under @param key.
+    """
+    with _lock:
+        if key not in _frames:
+            return None
+        _bind(session, name, key)
+        return _view(_frames[key]['value'])
+
+def put(session, name, value, key=None):
+    """
+    Keep a value for a session, unused frames and the data of other sessions are evicted if the memory budget is exceeded.
+
+    @param session: Key of the session.
+    @param name: Name of the value, e.g. dataframe.
+    @param value: Value to be kept, usually a compacted dataframe(see ingest.compact_frame). It must not be changed afterwards.
+    @param key: [Optional] Content key of the value, other sessions can attach() to it. None keeps the value private to the session.
+    """
+    if key is None:
+        key = ('private', session, name)
+    size = size_of(value)
+    with _lock:
+        frame = _frames.setdefault(key, {'refs': set()})
+        # a shared frame is never replaced, sessions holding it may be using it right now
+        if 'value' not in frame or isinstance(key, tuple):
+            frame.update(value=value, bytes=size, seen=time.time())
+        _bind(session, name, key)
+        _evict()
+
+def drop(session, names):
+    """
+    Forget values of a session, e.g. when a new file is uploaded.
+
+    @param session: Key of the session.
+    @param names: @Array of names of the values.
+    """
+    with _lock:
+        entry = _sessions.get(session)
+        if entry is None:
+            return
+        for name in names:
+            if name in entry['values']:
+                _release(session, name)
+
+def used_bytes():
+    """
+    @return: Bytes of session data kept by the server, every shared frame counted once.
+    """
+    with _lock:
+        return sum(frame['bytes'] for frame in _frames.values())
+
+def _bind(session, name, key):
+    # caller holds _lock
+    entry = _sessions.setdefault(session, {'seen': 0, 'values': {}})
+    if entry['values'].get(name) != key and name in entry['values']:
+        _release(session, name)
+    entry['seen'] = time.time()
+    entry['values'][name] = key
+    _frames[key]['refs'].add((session, name))
+    _frames[key]['seen'] = entry['seen']
+
+def _release(session, name):
+    # caller holds _lock, the frame stays around unused until the budget needs its memory
+    key = _sessions[session]['values'].pop(name)
+    frame = _frames[key]
+    frame['refs'].discard((session, name))
+    # private frames can never be attached to again
+    if not frame['refs'] and isinstance(key, tuple):
+        del _frames[key]
+
+def _drop_session(session):
+    # caller holds _lock
+    for name in list(_sessions[session]['values']):
+        _release(session, name)
+    del _sessions[session]
+
+def _owns_frames(session):
+    # caller holds _lock, True if @param session holds a frame no other session holds
+    return any(all(ref[0] == session for ref in _frames[key]['refs']) for key in _sessions[session]['values'].values())
+
+def _evict():
+    # caller holds _lock
+    now = time.time()
+    for session in [key for key, entry in _sessions.items() if now - entry['seen'] > idle_seconds]:
+        _drop_session(session)
+
+    while sum(frame['bytes'] for frame in _frames.values()) > memory_budget:
+        # frames no session holds anymore go first, least recently used first
+        unused = [key for key, frame in _frames.items() if not frame['refs']]
+        if unused:
+            del _frames[min(unused, key=lambda key: _frames[key]['seen'])]
+            continue
+        # then the least recently active sessions, the most recent one is always kept.
+        # Sessions whose frames are all shared with other sessions are skipped, dropping them would free nothing
+        latest = max(_sessions, key=lambda key: _sessions[key]['seen'], default=None)
+        owners = [key for key in _sessions if key != latest and _owns_frames(key)]
+        if not owners:
+            break
+        _drop_session(min(owners, key=lambda key: _sessions[key]['seen']))
@@ -2,17 +2,28 @@ from requests import head
 #for pthon3.10
 import collections 
 import collections.abc
+import re
+from copy import deepcopy
+
+# Pandas for dataframes
+import pandas as pd
+import numpy as np
 
 # for pptx
 from pptx.util import Inches, Cm, Pt
 from pptx.dml.color import ColorFormat, RGBColor
 from pptx.enum.text import MSO_ANCHOR
 from pptx.oxml.xmlchemy import OxmlElement
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
+from pptx.table import _Cell
 
 # for charts
 from pptx.chart.data import CategoryChartData, ChartData
 from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION, XL_LABEL_POSITION, XL_TICK_MARK,XL_TICK_LABEL_POSITION
 from pptx.enum.text import PP_ALIGN
+from pptx.parts.chart import ChartPart
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
 
 def split_start_address(user_start):
     """
@@ -93,6 +104,20 @@ def comparator_break(curr_val, true_val):
             return True
     return False
 
+def extract_columns(df, headers, global_null_value='-', mask=None):
+    """
+    Convert the selected columns of a dataframe into a 2D array of strings in one vectorized pass.
+
+    @param df: Dataframe object.
+    @param headers: Column titles to be extracted, in order.
+    @param global_null_value: Null values are replaced by this value.
+    @param mask: [Optional] Boolean series, only rows where mask is True are extracted.
+    @return: Numpy 2D array of strings, one entry per row.
+    """
+    sub = df[headers] if mask is None else df.loc[mask, headers]
+    sub = sub.where(sub.notna(), global_null_value)
+    return sub.astype(str).to_numpy(dtype=object)
+
 
 def add_logo(prs, slide):
     """
@@ -139,7 +164,25 @@ def _set_cell_border(cell, border_color="000000", border_width='12700'):
 
 
 
-def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
+def _add_chart(slide, chartType, x, y, cx, cy, chart_data, workbook=True):
+    """
+    Add a chart to @param slide, like slide.shapes.add_chart.
+    Without @param workbook the chart part only holds the chart XML with the values it displays,
+    the Excel workbook python-pptx embeds for every chart is never generated.
+
+    @return: Graphic frame holding the chart.
+    """
+    shapes = slide.shapes
+    if workbook:
+        return shapes.add_chart(chartType, x, y, cx, cy, chart_data)
+    package = shapes.part.package
+    chart_part = ChartPart.load(package.next_partname(ChartPart.partname_template), CT.DML_CHART, package=package, blob=chart_data.xml_bytes(chartType))
+    rId = shapes.part.relate_to(chart_part, RT.CHART)
+    graphicFrame = shapes._add_chart_graphicFrame(rId, x, y, cx, cy)
+    shapes._recalculate_extents()
+    return shapes._shape_factory(graphicFrame)
+
+def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart='', workbook=True):
     """
     Creates a chart on @param slide else add a new slide.
 
@@ -147,8 +190,10 @@ def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
     @param data: @2DArray, first entry is for categories, second entry is the respective values. e.g. [x-axis_data, y-axis_data]
     @param position: @Array containing 4 elements: [left, top, width, height] in inches.
     @param slide: slide object, None if slide is to be appended to existing presentation else pass the slide object.
-    @param typeofchart: type of chart, e.g: bar,pie,donut.
+    @param typeofchart: type of chart, e.g: bar,pie,donut,stacked,clustered.
     @param nameofchart: Title of Chart that appears on PPT slide.
+    @param workbook: Embed an Excel workbook holding the data of the chart. Without it the chart only holds the values
+            it displays, it is a lot faster to build and smaller, but its data can not be edited in PowerPoint.
     """
 
     # Blank slide with title, is susceptible to change(depends on layout of the template).
@@ -168,7 +213,12 @@ def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
 
     # Add chart categories and values
     chart_data.categories = data[0]
-    chart_data.add_series(nameofchart, tuple(data[1]))
+    if len(data[1]) > 0 and isinstance(data[1][0], (list, tuple)):
+        # several series, e.g. from group_categories: [[series name, values], ...]
+        for name, values in data[1]:
+            chart_data.add_series(name, tuple(values))
+    else:
+        chart_data.add_series(nameofchart, tuple(data[1]))
 
     # identify chart type
     if typeOfChart == 'bar':
@@ -176,8 +226,8 @@ def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
         chartType = XL_CHART_TYPE.COLUMN_CLUSTERED
         
         # create the chart
-        chart = slide.shapes.add_chart(
-            chartType, x, y, cx, cy, chart_data
+        chart = _add_chart(
+            slide, chartType, x, y, cx, cy, chart_data, workbook
         ).chart
 
         # Cosmetic changes to Chart
@@ -210,8 +260,8 @@ def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
         chartType = XL_CHART_TYPE.PIE
 
         # Create the chart
-        chart = slide.shapes.add_chart(
-            chartType, x, y, cx, cy, chart_data
+        chart = _add_chart(
+            slide, chartType, x, y, cx, cy, chart_data, workbook
         ).chart
 
         # Cosmetic changes to the chart
@@ -231,8 +281,8 @@ def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
         chartType = XL_CHART_TYPE.DOUGHNUT
 
         # Create the chart
-        chart = slide.shapes.add_chart(
-            chartType, x, y, cx, cy, chart_data
+        chart = _add_chart(
+            slide, chartType, x, y, cx, cy, chart_data, workbook
         ).chart
 
         # Cosmetic changes to the chart
@@ -247,9 +297,78 @@ def create_a_chart(prs, data, position, slide, typeOfChart, nameofchart=''):
         # data_labels.number_format = '0.0%'
         # data_labels.position = XL_LABEL_POSITION.OUTSIDE_END
         # data_labels.font.size = Pt(12)
+    elif typeOfChart in ('stacked', 'clustered'):
+        # Establish chart type, one series per value of the group by column
+        chartType = XL_CHART_TYPE.COLUMN_STACKED if typeOfChart == 'stacked' else XL_CHART_TYPE.COLUMN_CLUSTERED
+
+        # Create the chart
+        chart = _add_chart(
+            slide, chartType, x, y, cx, cy, chart_data, workbook
+        ).chart
+
+        # Cosmetic changes to Chart
+        yaxis = chart.value_axis
+        xaxis = chart.category_axis
+        yaxis.tick_labels.number_format = '0%'
+        yaxis.tick_labels.number_format_is_linked = False
+        yaxis.has_major_gridlines = False
+        xaxis.tick_labels.font.size = Pt(11)
+
+        # the series are told apart by the legend
+        chart.has_legend = True
+        chart.legend.position = XL_LEGEND_POSITION.BOTTOM
+        chart.legend.include_in_layout = False
     return
 
-def create_a_slide_with_data(prs, data, titleofslide='',global_null_value='-',sizes=None):
+# Cell templates of the fast table path, they hold exactly what the per cell path of create_a_slide_with_data produces.
+_CELL_XML = (
+    '<a:tc %s>'
+    '<a:txBody><a:bodyPr/><a:lstStyle/><a:p><a:pPr algn="ctr"><a:defRPr sz="1050">'
+    '<a:solidFill><a:srgbClr val="000000"/></a:solidFill><a:latin typeface="Adobe Clean"/>'
+    '</a:defRPr></a:pPr></a:p></a:txBody>'
+    '<a:tcPr anchor="ctr">%s<a:solidFill><a:srgbClr val="%s"/></a:solidFill></a:tcPr>'
+    '</a:tc>'
+)
+_BORDER_XML = (
+    '<a:lnB w="12700" cap="flat" cmpd="sng" algn="ctr"><a:solidFill><a:srgbClr val="e2e2e2"/></a:solidFill>'
+    '<a:prstDash val="solid"/><a:round/><a:headEnd type="none" w="med" len="med"/><a:tailEnd type="none" w="med" len="med"/></a:lnB>'
+)
+_header_cell = parse_xml(_CELL_XML % (nsdecls('a'), '', 'E2E2E2'))
+_body_cell = parse_xml(_CELL_XML % (nsdecls('a'), _BORDER_XML, 'FFFFFF'))
+# characters python-pptx treats specially(line breaks, vertical tabs, escaped control characters)
+_special_chars = re.compile('[\x00-\x1f\x7f]')
+
+def _fill_table_fast(table, data, global_null_value='-'):
+    """
+    Fill @param table with @param data in one lxml pass over the <a:tbl> element.
+    Every cell is a copy of the header or body cell template with its text added,
+    styles are set once in the templates instead of once per cell.
+
+    @param table: python-pptx table created by add_table, with as many rows and columns as @param data.
+    @param data: @2DArray where first entry is the column headers and rest of the entries are the rows.
+    @param global_null_value: Value shown instead of nan.
+    """
+    tbl = table._tbl
+    for i, tr in enumerate(tbl.tr_lst):
+        template = _header_cell if i == 0 else _body_cell
+        row = data[i]
+        for j, tc in enumerate(tr.tc_lst):
+            value = str(row[j])
+            # If value of data is nan, replace it with global_null_value
+            if value == 'nan':
+                value = global_null_value
+            if _special_chars.search(value):
+                # rare case, the cell is left to python-pptx which takes care of the special characters
+                _style_cell(_Cell(tc, table), value, i == 0)
+                continue
+            # the empty cell created by add_table is replaced by a copy of the template
+            new_tc = deepcopy(template)
+            if value != '':
+                t = SubElement(SubElement(new_tc[0][2], 'a:r'), 'a:t')
+                t.text = value
+            tr.replace(tc, new_tc)
+
+def create_a_slide_with_data(prs, data, titleofslide='',global_null_value='-',sizes=None, headers=None, fast=True):
     """
     Create a slide and present the data.
 
@@ -257,7 +376,13 @@ def create_a_slide_with_data(prs, data, titleofslide='',global_null_value='-',si
     @param data: @2DArray where first entry is the column headers and rest of the entries are the rows to be displayed on a slide.
     @param titleofslide: Title of the slide to be displayed in the PPT.
     @param sizes: Experimental feature for variable size columns on the PPT slide.[Not Implemented]
+    @param headers: [Optional] Column headers, when passed @param data only contains the rows(e.g. a view of a bigger array).
+    @param fast: Build the table XML from prebuilt row templates instead of styling every cell through python-pptx, the output is the same.
     """
+    # the column headers are put on top of the rows, rows of a numpy array stay views and are not copied
+    if headers is not None:
+        data = [headers] + list(data)
+
     # n: Total number of rows, m: Total number of columns
     n = len(data)
     m = len(data[0])
@@ -289,6 +414,11 @@ def create_a_slide_with_data(prs, data, titleofslide='',global_null_value='-',si
     # for i in range(len(sizes)):
     #     table.columns[i].width = Inches(sizes[i])
 
+    # fast path: the cells are built straight from the row templates
+    if fast:
+        _fill_table_fast(table, data, global_null_value)
+        return
+
     # For every cell in the table being displayed, map data to corresponding cell.
     for i in range(n):
         for j in range(m):
@@ -298,53 +428,106 @@ def create_a_slide_with_data(prs, data, titleofslide='',global_null_value='-',si
             # If value of data is nan, replace it with global_null_value
             if value == 'nan':
                 value = global_null_value
-            
-            # Cosmetic changes for table cells.
-            cell.text = value
-            cell.vertical_anchor = MSO_ANCHOR.MIDDLE
-            paragraph = cell.text_frame.paragraphs[0]
-            paragraph.font.size = Pt(10.5)
-            paragraph.alignment = PP_ALIGN.CENTER
-            paragraph.font.color.rgb = RGBColor(0x00,0x00,0x00)
-            paragraph.font.name = 'Adobe Clean'
-            if i != 0:
-                _set_cell_border(cell, "e2e2e2")
-                cell.fill.solid()
-                cell.fill.fore_color.rgb = RGBColor(0xFF, 0xFF, 0xFF)
-            else:
-                cell.fill.solid()
-                cell.fill.fore_color.rgb = RGBColor(0xE2, 0xE2, 0xE2)
+            _style_cell(cell, value, i == 0)
+
+def _style_cell(cell, value, header=False):
+    """
+    Set the text of a table cell and apply the table cosmetics.
+
+    @param cell: python-pptx table cell.
+    @param value: Text of the cell.
+    @param header: True for cells of the header row.
+    """
+    # Cosmetic changes for table cells.
+    cell.text = value
+    cell.vertical_anchor = MSO_ANCHOR.MIDDLE
+    paragraph = cell.text_frame.paragraphs[0]
+    paragraph.font.size = Pt(10.5)
+    paragraph.alignment = PP_ALIGN.CENTER
+    paragraph.font.color.rgb = RGBColor(0x00,0x00,0x00)
+    paragraph.font.name = 'Adobe Clean'
+    if not header:
+        _set_cell_border(cell, "e2e2e2")
+        cell.fill.solid()
+        cell.fill.fore_color.rgb = RGBColor(0xFF, 0xFF, 0xFF)
+    else:
+        cell.fill.solid()
+        cell.fill.fore_color.rgb = RGBColor(0xE2, 0xE2, 0xE2)
 
 
 def convert_to_categories(dataframe, global_null_value='-', div=False):
     """
     Break data into key,value pairs where keys are the categories and value is the frequency of that particular category in data.
+    Categories are kept in order of first appearance, frequencies are counted in one vectorized pass over the category codes.
     
     @param dataframe: Dataframe object.
     @param global_null_value: Global Null value.
     @param div: Normalize the frequencies to fit a range(100% here).
     """
+    # entries equal to the null value are not counted
+    dataframe = dataframe[dataframe.astype(str) != global_null_value]
+
+    # codes[i] is the position of the category of the i-th entry in uniques
+    codes, uniques = pd.factorize(dataframe)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
 
-    # Make frequency dictionary of data, where key is a category and value is its frequency.
-    _dict ={}
-    for name,value in dataframe.iteritems():
-        if str(value) == global_null_value:
-            continue
-        if value in _dict:
-            _dict[value]+=1
-        else:
-            _dict[value]=1
-    # Break the frequency dictionary into a 2D array where first entry is the categories and second entry is the frequencies associated with it.
-    data = [[],[]]
-    for key,value in _dict.items():
-        data[0].append(key)
-        data[1].append(value)
+    # 2D array where first entry is the categories and second entry is the frequencies associated with it.
+    data = [uniques.tolist(), counts.tolist()]
     if div:
         sm = sum(data[1])
         for i in range(len(data[1])):
             data[1][i] /= sm
     return data
 
+def group_categories(dataframe, group_col, global_null_value='-', div=False):
+    """
+    Frequency table of @param dataframe split by a second column, used by stacked and clustered charts.
+
+    @param dataframe: Dataframe object holding the category column first and @param group_col second.
+    @param group_col: Title of the column the frequencies are split by, every value of it becomes a series.
+    @param global_null_value: Global Null value.
+    @param div: Normalize the frequencies to fit a range(100% of all entries here).
+    @return: [categories, [[series name, frequencies], ...]]
+    """
+    col = dataframe.columns[0]
+    dataframe = dataframe[(dataframe[col].astype(str) != global_null_value) & (dataframe[group_col].astype(str) != global_null_value)]
+
+    cat_codes, categories = pd.factorize(dataframe[col])
+    grp_codes, groups = pd.factorize(dataframe[group_col])
+    # one pass over the pairs of codes
+    counts = np.bincount(grp_codes*len(categories) + cat_codes, minlength=len(groups)*len(categories))
+    counts = counts.reshape(len(groups), len(categories))
+    if div and counts.sum() > 0:
+        counts = counts/counts.sum()
+    return [categories.tolist(), [[str(groups[i]), counts[i].tolist()] for i in range(len(groups))]]
+
+def category_counts(df, col, global_null_value='-', div=False, group_col=None, memo=None, scope=None):
+    """
+    Frequency table of column @param col of @param df, memoized in @param memo.
+    Several charts on the same column cost a single pass over the column while the memo is kept, i.e. for one render.
+
+    @param df: Dataframe object.
+    @param col: Column title.
+    @param global_null_value: Global Null value.
+    @param div: Normalize the frequencies to fit a range(100% here).
+    @param group_col: [Optional] Column title the frequencies are split by, see group_categories.
+    @param memo: [Optional] Dictionary of the frequency tables computed so far, nothing is memoized without it.
+    @param scope: [Optional] Hashable telling apart the dataframes sharing @param memo, e.g. the rows of a deck section.
+    @return: Same as convert_to_categories, or group_categories when @param group_col is passed.
+    """
+    if group_col == col:
+        group_col = None
+    entry = (scope, col, group_col, global_null_value, div)
+    if memo is not None and entry in memo:
+        return memo[entry]
+    if group_col is None:
+        data = convert_to_categories(df[col], global_null_value, div)
+    else:
+        data = group_categories(df[[col, group_col]], group_col, global_null_value, div)
+    if memo is not None:
+        memo[entry] = data
+    return data
+
 """
 HVLC was here
 """
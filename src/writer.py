@@ -0,0 +1,128 @@
+import re
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import quoteattr
+
+# for pptx
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.opc.package import Part
+from pptx.opc.packuri import PackURI
+
+from src import cache
+
+
+class StreamingPptxWriter:
+    """
+    Writes a deck slide by slide into the output zip, so that memory stays flat no matter how many slides the deck has.
+
+    Slides are rendered into self.prs as usual, flush() then writes every new slide(and the charts or other parts it uses)
+    straight into the zip and drops it from the presentation, which releases its XML tree. The presentation part,
+    the parts of the template and the content types are written by close(), once the list of slides is known.
+
+    e.g.
+        writer = StreamingPptxWriter(template, 'deck.pptx')
+        create_a_slide_with_data(writer.prs, data)
+        writer.flush()
+        writer.close()
+    """
+
+    def __init__(self, template, out):
+        """
+        @param template: Bytes of the template pptx file.
+        @param out: Path or file object the deck is written to.
+        """
+        self.template = template
+        self.prs = cache.load_template(template)
+        self.package = self.prs.part.package
+        self.zip = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+
+        # slides of the template stay in the presentation, only slides after them are streamed
+        self.start = len(self.prs.slides)
+        # parts of the template, they are written by close()
+        self.template_parts = set(id(part) for part in self.package.iter_parts())
+        # part names already taken and content types of the parts written so far
+        self.used = set(str(part.partname) for part in self.package.iter_parts())
+        self.content_types = {}
+        # ids of the parts written by the current flush
+        self.written = set()
+        # names of the streamed slides, in order
+        self.slide_partnames = []
+
+    def _free_partname(self, partname):
+        # e.g. /ppt/charts/chart3.xml -> first free /ppt/charts/chart%d.xml
+        tmpl = re.sub(r'\d+(\.\w+)$', r'%d\1', str(partname))
+        if '%d' not in tmpl:
+            return PackURI(str(partname))
+        i = 1
+        while tmpl % i in self.used:
+            i += 1
+        return PackURI(tmpl % i)
+
+    def _write_part(self, part):
+        # new parts related to this one are written first, each under a name that is not taken yet
+        if id(part) in self.template_parts or id(part) in self.written:
+            return
+        self.written.add(id(part))
+        part.partname = self._free_partname(part.partname)
+        self.used.add(str(part.partname))
+        self.content_types[str(part.partname)] = part.content_type
+        for rId, rel in list(part.rels.items()):
+            if not rel.is_external:
+                self._write_part(rel.target_part)
+        self.zip.writestr(part.partname.membername, part.blob)
+        if len(part.rels) > 0:
+            self.zip.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+    def flush(self):
+        """
+        Write the slides rendered since the last flush into the zip and release them.
+        """
+        prs_part = self.prs.part
+        sldIdLst = self.prs.slides._sldIdLst
+        for sldId in list(sldIdLst)[self.start:]:
+            slide_part = prs_part.related_part(sldId.rId)
+            self._write_part(slide_part)
+
+            # the slide is dropped from the presentation, close() links a stub of it again
+            sldIdLst.remove(sldId)
+            prs_part.drop_rel(sldId.rId)
+            self.slide_partnames.append(str(slide_part.partname))
+        # written parts are released now, their ids may be taken by new parts
+        self.written = set()
+
+    def close(self):
+        """
+        Write the presentation part listing all the slides, the parts of the template and the content types.
+        """
+        self.flush()
+
+        # stubs stand in for the written slides, so that presentation.xml and its rels point to them
+        prs_part = self.prs.part
+        sldIdLst = self.prs.slides._sldIdLst
+        stubs = set()
+        for partname in self.slide_partnames:
+            stub = Part(partname=PackURI(partname), content_type=CT.PML_SLIDE, package=self.package, blob=b'')
+            stubs.add(id(stub))
+            sldIdLst.add_sldId(prs_part.relate_to(stub, RT.SLIDE))
+
+        for part in self.package.iter_parts():
+            if id(part) in stubs or str(part.partname) in self.content_types:
+                continue
+            self.content_types[str(part.partname)] = part.content_type
+            self.zip.writestr(part.partname.membername, part.blob)
+            if len(part.rels) > 0:
+                self.zip.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+        # package relationships do not change, they are taken from the template as they are
+        with zipfile.ZipFile(BytesIO(self.template)) as template_zip:
+            self.zip.writestr('_rels/.rels', template_zip.read('_rels/.rels'))
+
+        xml = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+               '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+               '<Default Extension="xml" ContentType="application/xml"/>']
+        for partname, content_type in self.content_types.items():
+            xml.append('<Override PartName=%s ContentType=%s/>' % (quoteattr(partname), quoteattr(content_type)))
+        xml.append('</Types>')
+        self.zip.writestr('[Content_Types].xml', ''.join(xml))
+        self.zip.close()
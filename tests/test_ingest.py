@@ -0,0 +1,60 @@
+from io import BytesIO
+
+import openpyxl
+from openpyxl.styles import PatternFill
+
+from src import ingest
+from src.ingest import read_table_grid, slice_region, detect_header_row
+
+
+class Upload(BytesIO):
+    # uploaded file, the format is told by its name
+    def __init__(self, data, name='data.csv'):
+        super().__init__(data)
+        self.name = name
+
+def region(data):
+    grid = read_table_grid(Upload(data))
+    row, col = detect_header_row(grid)
+    return (row, col), slice_region(grid, row, col).to_dict('list')
+
+def test_csv_title_and_blank_lines_keep_row_numbers():
+    assert region(b'Weekly report\n\nID,Status\n1,Open\n2,\n') == ((3, 1), {'ID': ['1', '2'], 'Status': ['Open', '-']})
+    assert region(b'\n\nA,B,C\n1,2,3') == ((3, 1), {'A': ['1'], 'B': ['2'], 'C': ['3']})
+
+def test_csv_ragged_lines():
+    assert region(b'A,B,C\n1,2\n3,4,5\n')[1] == {'A': ['1', '3'], 'B': ['2', '4'], 'C': ['-', '5']}
+
+def test_csv_texts_are_kept():
+    assert region(b'A,B\nNA,null\n')[1] == {'A': ['NA'], 'B': ['null']}
+
+def test_csv_encodings():
+    text = 'Report\n\nName,City\nJosé,Zürich\n'
+    expected = {'Name': ['José'], 'City': ['Zürich']}
+    assert region(text.encode('utf-8'))[1] == expected
+    assert region(text.replace('Report\n\n', '').encode('utf-8-sig'))[1] == expected
+    # Excel exports on Windows, rectangular or not
+    assert region(text.encode('cp1252'))[1] == expected
+    assert region(text.replace('Report\n\n', '').encode('cp1252'))[1] == expected
+
+def workbook(rows, formatted=0):
+    # xlsx upload of @param rows, followed by @param formatted rows that have a fill but no values
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    for i in range(formatted):
+        ws.cell(len(rows)+i+1, 1).fill = PatternFill('solid', fgColor='FFFF00')
+    data = BytesIO()
+    wb.save(data)
+    return Upload(data.getvalue(), 'data.xlsx')
+
+def test_excel_grid_stops_at_the_last_row():
+    grid = ingest.read_excel_grid(workbook([['Report'], [], ['ID', 'Status'], [1, 'Open'], [], [2, None]], formatted=50))
+    assert grid.shape == (6, 2)
+    assert grid[0].tolist() == ['Report', None, 'ID', '1', None, '2']
+
+def test_excel_grid_stops_after_a_gap(monkeypatch):
+    monkeypatch.setattr(ingest, 'grid_gap_rows', 3)
+    rows = [['ID'], [1], [None], [None], [2], [None], [None], [None], [3]]
+    assert ingest.read_excel_grid(workbook(rows))[0].tolist() == ['ID', '1', None, None, '2']
@@ -0,0 +1,98 @@
+import os
+from io import BytesIO
+
+import pandas as pd
+
+from src import cache, perf, pipeline, util
+from src.pipeline import select_rows
+
+template = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'template.pptx')
+
+
+def frame():
+    return pd.DataFrame({'a': ['3', '-', '10', '2', 'x'], 'b': list('pqrst')})
+
+def test_select_rows_top_numbers_first():
+    assert select_rows(frame(), None, ['a', True], 2)['b'].tolist() == ['r', 'p']
+    assert select_rows(frame(), None, ['a', False], 2)['b'].tolist() == ['s', 'p']
+
+def test_select_rows_top_covers_every_row():
+    # the rows without a number are appended once, after the numbers
+    assert select_rows(frame(), None, ['a', True], 10)['b'].tolist() == ['r', 'p', 's', 'q', 't']
+    assert select_rows(frame(), None, ['a', False], 4)['b'].tolist() == ['s', 'p', 'r', 'q']
+
+def test_select_rows_sort_without_top():
+    assert select_rows(frame(), None, ['a', True])['b'].tolist() == ['r', 'p', 's', 'q', 't']
+
+def test_select_rows_text_sort_and_filter():
+    df = pd.DataFrame({'a': ['b', 'c', 'a'], 'n': ['5', '40', '60']})
+    assert select_rows(df, None, ['a', False], 2)['a'].tolist() == ['a', 'b']
+    assert select_rows(df, ['n', '> 10'])['a'].tolist() == ['c', 'a']
+    assert select_rows(df, None, None, 1)['a'].tolist() == ['b']
+
+def deck_data():
+    df = pd.DataFrame({'ID': [str(i) for i in range(40)], 'Status': ['Open', '-']*20, 'Region': ['US', 'EU', 'APAC', '-']*10})
+    config = pipeline.default_config()
+    config.update(openCaseCol='Status', opcsheads=['ID', 'Region'], cscsheads=['ID'], ext_tab_arr=[[['ID', 'Region'], 'Table 1', 6]], ext_cha_arr=[['Region', 'Pie', 'Chart 1', None]])
+    with open(template, 'rb') as f:
+        return df, config, f.read()
+
+def test_render_deck_incremental_and_reuse(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path))
+    df, config, tmpl = deck_data()
+    outputs, timers = [], []
+    for i in range(3):
+        output, timer = BytesIO(), perf.Timer()
+        slides = pipeline.render_deck(df, config, tmpl, output, timer=timer, incremental=True, reuse=True)
+        outputs.append((slides, pipeline._count_slides(output.getvalue())))
+        timers.append({ele['stage']: ele for ele in timer.records()})
+    # the same deck every time, the later renders are served from the deck cache
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert [ele['deck_cache']['hits'] for ele in timers] == [0, 1, 1]
+
+def test_render_deck_incremental_reuses_sections(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path))
+    df, config, tmpl = deck_data()
+    first = BytesIO()
+    slides = pipeline.render_deck(df, config, tmpl, first, incremental=True)
+    # only the chart changes, the table sections come from the cache
+    config['ext_cha_arr'] = [['Region', 'Bar', 'Chart 1', None]]
+    second, timer = BytesIO(), perf.Timer()
+    assert pipeline.render_deck(df, config, tmpl, second, timer=timer, incremental=True) == slides
+    assert pipeline._count_slides(first.getvalue()) == pipeline._count_slides(second.getvalue())
+    assert {ele['stage']: ele for ele in timer.records()}['render_charts']['slides'] == 1
+    assert 'render_tables' not in {ele['stage'] for ele in timer.records()}
+
+def test_render_deck_incremental_blank_columns(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path))
+    df, config, tmpl = deck_data()
+    # a table of blank columns only depends on the number of rows
+    config.update(openCaseCol=None, ext_cha_arr=[], ext_tab_arr=[[['Notes'], 'Notes', 6]])
+    # every render gets its own copy, like a RenderJob, the blank column is added to the copy only
+    assert pipeline.render_deck(df.copy(), config, tmpl, BytesIO(), incremental=True) == 7 + 1
+    assert pipeline.render_deck(df.iloc[:12].copy(), config, tmpl, BytesIO(), incremental=True) == 2 + 1
+
+def test_render_deck_streaming_skips_incremental(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path))
+    df, config, tmpl = deck_data()
+    expected = pipeline.render_deck(df, config, tmpl, BytesIO())
+    output = tmp_path / 'deck.pptx'
+    assert pipeline.render_deck(df, config, tmpl, str(output), streaming=True, incremental=True) == expected
+    assert pipeline._count_slides(output.read_bytes()) - pipeline._count_slides(tmpl) == expected
+    # no section was rendered into a presentation of its own
+    assert not any(name.endswith('.pptx') for name in os.listdir(tmp_path) if name != 'deck.pptx')
+
+def test_build_tasks_share_frequency_tables(monkeypatch):
+    df, config, tmpl = deck_data()
+    config.update(openCaseCol=None, ext_tab_arr=[], section_by='Status',
+                  ext_cha_arr=[['Region', 'Pie', 'Chart 1', None], ['Region', 'Bar', 'Chart 2', None]])
+    counted = []
+    convert = util.convert_to_categories
+    monkeypatch.setattr(util, 'convert_to_categories', lambda *args: counted.append(1) or convert(*args))
+    tasks = pipeline.build_tasks(df, config)
+    # both charts of a section share one table, the sections do not share theirs
+    assert len(tasks) == 4
+    assert len(counted) == 2
+    # the tables are not kept past the render
+    pipeline.build_tasks(df, config)
+    assert len(counted) == 4
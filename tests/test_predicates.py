@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from src.predicates import compile_rule, assign_groups, column_numbers
+
+
+def passed(rule, values, global_null_value='-'):
+    # values of the rows passing @param rule
+    column = pd.Series(values, dtype=object)
+    return column[compile_rule(rule, global_null_value)(column)].tolist()
+
+def test_value_list():
+    assert passed('-,NO', ['-', 'NO', 'YES', ' NO']) == ['-', 'NO']
+    # values are taken as they are, spaces included
+    assert passed('-, NO', ['-', 'NO', ' NO']) == ['-', ' NO']
+    assert passed(['-', 'NO'], ['-', 'NO', 'YES']) == ['-', 'NO']
+
+def test_values_without_operators_are_literal():
+    assert passed('Rock and Roll', ['Rock and Roll', 'Rock', 'Roll']) == ['Rock and Roll']
+    assert passed('Open or Pending,Closed', ['Open or Pending', 'Closed', 'Open']) == ['Open or Pending', 'Closed']
+
+def test_quoted_values():
+    assert passed('"Rock and Roll" or "=N/A"', ['Rock and Roll', '=N/A', 'Rock']) == ['Rock and Roll', '=N/A']
+
+def test_comparisons():
+    values = ['3', '30', '30.5', '-', 'x', '90']
+    assert passed('> 30', values) == ['30.5', '90']
+    assert passed('<=30', values) == ['3', '30']
+    assert passed('= 30', values) == ['30']
+    assert passed('!= 30', values) == ['3', '30.5', '90']
+    assert passed('!= x', values) == ['3', '30', '30.5', '-', '90']
+
+def test_ranges():
+    values = ['3', '30', '60', '90', '91', '-']
+    assert passed('30..90', values) == ['30', '60', '90']
+    assert passed('..30', values) == ['3', '30']
+    assert passed('90..', values) == ['90', '91']
+
+def test_regex_and_empty():
+    values = ['ESC-1', 'esc-2', 'NEW', '-', None, '']
+    assert passed('~ ^ESC-\\d+', values) == ['ESC-1']
+    assert passed('empty', values) == ['-', None, '']
+    assert passed('non-empty', values) == ['ESC-1', 'esc-2', 'NEW']
+
+def test_not_and_or():
+    values = ['5', '40', '100', '-']
+    assert passed('> 30 and < 90', values) == ['40']
+    assert passed('< 10 or > 90', values) == ['5', '100']
+    # "and" binds first
+    assert passed('< 10 or > 30 and < 90', values) == ['5', '40']
+    assert passed('not empty', values) == ['5', '40', '100']
+
+def test_arrow_strings():
+    pytest.importorskip('pyarrow')
+    column = pd.Series(['1', None, '40'], dtype='string[pyarrow]')
+    assert compile_rule('> 30')(column).tolist() == [False, False, True]
+    assert compile_rule('!= 1')(column).tolist() == [False, False, True]
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        compile_rule('> abc')
+    with pytest.raises(ValueError):
+        compile_rule('~ (')
+
+def test_assign_groups():
+    column = pd.Series(['100', '45', '10', '0', '-'], dtype=object)
+    # the first rule a row passes wins
+    assert assign_groups(column, ['> 90', '> 30', '> 0']).tolist() == [0, 1, 2, -1, -1]
+    assert assign_groups(column, []).tolist() == [-1]*5
+    assert assign_groups(column, ['empty', 'non-empty']).tolist() == [1, 1, 1, 1, 0]
+
+def test_column_numbers():
+    numbers = column_numbers(pd.Series(['1', 'x', '2.5', None, '1'], dtype=object))
+    assert numbers.isna().tolist() == [False, True, False, True, False]
+    assert numbers.dropna().tolist() == [1.0, 2.5, 1.0]